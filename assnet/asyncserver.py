@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2011 Romain Bignon, Laurent Bachelier
+#
+# This file is part of assnet.
+#
+# assnet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# assnet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with assnet. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+import os
+import sys
+import errno
+import socket
+import signal
+import urllib
+import asyncore
+import asynchat
+import mimetools
+import threading
+import traceback
+from Queue import Queue
+from cStringIO import StringIO
+from tempfile import SpooledTemporaryFile
+
+from paste.fileapp import BLOCK_SIZE
+
+from .zerocopy import sendfile, SENDFILE_SUPPORT, FileWrapperFactory
+
+
+__all__ = ['AsyncServer']
+
+
+class FileProducer(object):
+    """
+    asynchat producer reading a file by blocks, up to size bytes if provided.
+    The channel may instead send it with sendfile(), from offset.
+    """
+
+    def __init__(self, fp, size=None):
+        self.fp = fp
+        self.offset = fp.tell()
+        if size is None:
+            size = os.fstat(fp.fileno()).st_size - self.offset
+        self.size = size
+
+    def more(self):
+        block_size = min(BLOCK_SIZE, self.size)
+        data = self.fp.read(block_size) if block_size else ''
+        self.size -= len(data)
+        if not data:
+            self.close()
+        return data
+
+    def close(self):
+        self.fp.close()
+
+
+class HTTPChannel(asynchat.async_chat):
+    """
+    Read a request, let the server run the application, and send the response.
+    Connections are closed after each response.
+    """
+    ac_in_buffer_size = 65536
+    ac_out_buffer_size = 65536
+    MAX_HEADERS_SIZE = 65536
+    # bodies larger than this are kept in a temporary file
+    MAX_MEMORY_BODY = 1024 * 1024
+
+    def __init__(self, server, sock, addr):
+        asynchat.async_chat.__init__(self, sock, map=server.map)
+        self.server = server
+        self.addr = addr
+        self.environ = None
+        self.received = 0
+        self.data = []
+        self.body = None
+        # an error response was sent, the request is ignored
+        self.failed = False
+        self.set_terminator('\r\n\r\n')
+
+    def collect_incoming_data(self, data):
+        if self.failed:
+            return
+        if self.body is not None:
+            self.body.write(data)
+            return
+        self.data.append(data)
+        self.received += len(data)
+        if self.received > self.MAX_HEADERS_SIZE:
+            self.send_error('431 Request Header Fields Too Large')
+
+    def found_terminator(self):
+        if self.failed:
+            # the rest of a read which was already too large
+            return
+        if self.environ is None:
+            try:
+                self.environ = self.server.build_environ(''.join(self.data), self.addr)
+            except ValueError:
+                return self.send_error('400 Bad Request')
+            self.data = []
+            self.body = SpooledTemporaryFile(max_size=self.MAX_MEMORY_BODY)
+            try:
+                length = int(self.environ.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                return self.send_error('400 Bad Request')
+            if length > 0:
+                self.set_terminator(length)
+                return
+        # the whole request was received, ignore anything else
+        self.set_terminator(None)
+        self.body.seek(0)
+        self.environ['wsgi.input'] = self.body
+        self.server.run_application(self)
+
+    def send_error(self, status):
+        if self.failed:
+            return
+        self.failed = True
+        self.data = []
+        self.set_terminator(None)
+        self.send_response(status, [('Content-Type', 'text/plain')], [status], None)
+
+    def send_response(self, status, headers, body, producer):
+        """
+        Called from the event loop.
+        """
+        if not self.connected:
+            # the client left
+            if producer is not None:
+                producer.close()
+            return
+        lines = ['HTTP/1.0 %s' % status]
+        lines.extend(['%s: %s' % (key, value) for key, value in headers
+                      if key.lower() != 'connection'])
+        lines.append('Connection: close')
+        self.push('\r\n'.join(lines) + '\r\n\r\n')
+        for data in body:
+            if data:
+                self.push(data)
+        if producer is not None:
+            self.push_with_producer(producer)
+        self.close_when_done()
+
+    def initiate_send(self):
+        # once everything before a file is sent, let the kernel send it
+        if SENDFILE_SUPPORT and self.producer_fifo \
+                and isinstance(self.producer_fifo[0], FileProducer):
+            self.send_file(self.producer_fifo[0])
+        else:
+            asynchat.async_chat.initiate_send(self)
+
+    def send_file(self, producer):
+        try:
+            sent = sendfile(self.socket.fileno(), producer.fp.fileno(),
+                            producer.offset, producer.size)
+        except OSError, e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            if e.errno in (errno.EPIPE, errno.ECONNRESET):
+                return self.handle_close()
+            raise
+        producer.offset += sent
+        producer.size -= sent
+        if not sent or producer.size <= 0:
+            self.producer_fifo.popleft()
+            producer.close()
+
+    def close(self):
+        # close the files of responses which were not sent completely
+        for producer in self.producer_fifo:
+            if hasattr(producer, 'close'):
+                producer.close()
+        self.producer_fifo.clear()
+        if self.body is not None:
+            self.body.close()
+        asynchat.async_chat.close(self)
+
+    def handle_error(self):
+        traceback.print_exc(file=sys.stderr)
+        self.close()
+
+
+class Trigger(asyncore.file_dispatcher):
+    """
+    Wake up the event loop from another thread to run a function in it.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.calls = Queue()
+        self.rfd, self.wfd = os.pipe()
+        asyncore.file_dispatcher.__init__(self, self.rfd, map=server.map)
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        try:
+            self.recv(8192)
+        except (OSError, socket.error):
+            pass
+        while not self.calls.empty():
+            func, args = self.calls.get()
+            func(*args)
+
+    def call(self, func, *args):
+        self.calls.put((func, args))
+        os.write(self.wfd, 'x')
+
+    def close(self):
+        asyncore.file_dispatcher.close(self)
+        os.close(self.wfd)
+
+
+class AsyncServer(asyncore.dispatcher):
+    """
+    HTTP server handling the connections in an event loop, and running
+    the WSGI application in a bounded pool of threads.
+    Files returned by paste's FileApp are sent from the event loop,
+    so slow downloads do not keep a thread busy.
+    """
+
+    def __init__(self, application, host, port, threads=10):
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.application = application
+        self.host = host
+        self.port = int(port)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, self.port))
+        self.listen(128)
+        self.trigger = Trigger(self)
+        self.requests = Queue()
+        self.threads = []
+        for i in xrange(threads):
+            thread = threading.Thread(target=self.run_thread)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        self.running = False
+
+    def serve(self):
+        print 'serving on http://%s:%s' % (self.host, self.port)
+        self.running = True
+        signal.signal(signal.SIGTERM, self._stop)
+        try:
+            while self.running:
+                asyncore.loop(timeout=1, use_poll=True, map=self.map, count=1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+            for i in xrange(len(self.threads)):
+                self.requests.put(None)
+
+    def _stop(self, signum, frame):
+        self.running = False
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            sock, addr = pair
+            HTTPChannel(self, sock, addr)
+
+    def build_environ(self, headers, addr):
+        """
+        Build the WSGI environ from the raw request headers.
+        Raises ValueError if they are invalid.
+        """
+        request_line, headers = (headers + '\r\n').split('\r\n', 1)
+        method, uri, protocol = request_line.split()
+        if '://' in uri:
+            uri = '/' + uri.split('://', 1)[1].partition('/')[2]
+        path, sep, query = uri.partition('?')
+        message = mimetools.Message(StringIO(headers))
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': urllib.unquote(path),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': protocol,
+            'REMOTE_ADDR': addr[0] if addr else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            # sends any part of the file, with sendfile() if possible
+            'wsgi.file_wrapper': FileWrapperFactory(),
+        }
+        for key in message.keys():
+            value = ','.join(message.getheaders(key))
+            key = key.upper().replace('-', '_')
+            if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[key] = value
+            else:
+                environ['HTTP_' + key] = value
+        return environ
+
+    def run_application(self, channel):
+        self.requests.put(channel)
+
+    def run_thread(self):
+        while True:
+            channel = self.requests.get()
+            if channel is None:
+                return
+            response = self.call_application(channel.environ)
+            self.trigger.call(channel.send_response, *response)
+
+    def call_application(self, environ):
+        """
+        Returns the (status, headers, body, producer) of the response.
+        """
+        response = {}
+        body = []
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+            return body.append
+
+        try:
+            result = self.application(environ, start_response)
+            # paste's _FileIter or our FileWrapper, let the event loop send the file
+            if hasattr(result, 'file') and hasattr(result, 'size'):
+                return (response['status'], response['headers'], body,
+                        FileProducer(result.file, result.size))
+            try:
+                body.extend(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            return (response['status'], response['headers'], body, None)
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+            return ('500 Internal Server Error', [('Content-Type', 'text/plain')],
+                    ['Internal Server Error'], None)
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2011 Romain Bignon, Laurent Bachelier
+#
+# This file is part of assnet.
+#
+# assnet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# assnet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with assnet. If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import json
+import time
+import errno
+import atexit
+import thread
+import sqlite3
+from threading import Lock
+from contextlib import contextmanager
+from copy import deepcopy
+from ConfigParser import RawConfigParser
+
+from .cache import LRUCache
+from .obj import ConfigDict
+
+
+__all__ = ['IBackend', 'FileBackend', 'SQLiteBackend', 'BACKENDS']
+
+
+class IBackend(object):
+    """
+    Where the storage objects are kept.
+    Objects are known by a name like "users/penguin", and their data
+    is a ConfigDict of sections holding unicode values.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self, name):
+        """
+        Returns the ConfigDict, or None if the object does not exist.
+        """
+        raise NotImplementedError()
+
+    def write(self, name, data):
+        raise NotImplementedError()
+
+    def get_mtime(self, name):
+        """
+        Returns None if the object does not exist.
+        """
+        raise NotImplementedError()
+
+    def remove(self, name):
+        raise NotImplementedError()
+
+    def read_many(self, names):
+        """
+        Read several objects at once.
+        Returns a dict of names to (mtime, data) tuples.
+        """
+        return dict([(name, (self.get_mtime(name), self.read(name))) for name in names])
+
+    def iter_names(self, dirname):
+        """
+        Get the sorted names of the objects in dirname (i.e. "users"),
+        without the dirname part.
+        """
+        raise NotImplementedError()
+
+    def get_path(self, name):
+        """
+        Get the file used to store an object, or None if there is none.
+        """
+        return None
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group writes, so they are either all done or not at all
+        if the backend supports it.
+        """
+        yield
+
+
+class FileBackend(IBackend):
+    """
+    Store each object in its own INI file.
+    """
+    # Parsed configurations, shared by all the instances of the process.
+    # Entries are kept until the file mtime, size or inode changes.
+    OBJECT_CACHE = LRUCache(2000)
+
+    def get_path(self, name):
+        return os.path.join(self.path, name)
+
+    def read(self, name):
+        return self._read(name)[1]
+
+    def read_many(self, names):
+        return dict([(name, self._read(name)) for name in names])
+
+    def _read(self, name):
+        """
+        Returns the mtime and data of an object, with only one stat.
+        """
+        path = self.get_path(name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.OBJECT_CACHE.pop(path)
+            return (None, None)
+
+        mtime = int(st.st_mtime)
+        stamp = (st.st_mtime, st.st_size, st.st_ino)
+        cached = self.OBJECT_CACHE.get(path)
+        if cached is not None and cached[0] == stamp:
+            # the caller is free to alter the data it gets
+            return (mtime, deepcopy(cached[1]))
+
+        config = RawConfigParser()
+        try:
+            with open(path, 'r') as fp:
+                config.readfp(fp)
+        except IOError:
+            return (None, None)
+
+        data = ConfigDict()
+        for sec in config.sections():
+            data[sec] = dict([(k, v.decode('utf-8')) for k, v in config.items(sec)])
+
+        self.OBJECT_CACHE.set(path, (stamp, deepcopy(data)))
+        return (mtime, data)
+
+    def write(self, name, data):
+        path = self.get_path(name)
+        destdir = os.path.dirname(path)
+        if not os.path.exists(destdir):
+            os.makedirs(destdir)
+        config = RawConfigParser()
+        for sec, items in data.iteritems():
+            config.add_section(sec)
+            for key, value in items.iteritems():
+                if isinstance(value, unicode):
+                    value = value.encode('utf-8')
+                if value is not None:
+                    config.set(sec, key, value)
+        self.OBJECT_CACHE.pop(path)
+        with open(path, 'wb') as fp:
+            config.write(fp)
+
+    def get_mtime(self, name):
+        path = self.get_path(name)
+        if os.path.exists(path):
+            return int(os.path.getmtime(path))
+
+    def remove(self, name):
+        path = self.get_path(name)
+        self.OBJECT_CACHE.pop(path)
+        os.unlink(path)
+
+    def iter_names(self, dirname):
+        path = os.path.join(self.path, dirname)
+        if os.path.exists(path):
+            for name in sorted(os.listdir(path)):
+                yield name
+
+
+class SQLiteBackend(IBackend):
+    """
+    Store all objects in a single SQLite database.
+    The data is normalized like an INI file would do,
+    so objects behave the same way as with FileBackend.
+    """
+    FILENAME = 'storage.sqlite'
+    # (pid, thread, filename): [connection, transactions level]
+    # shared by the instances, as there is one per request
+    CONNECTIONS = {}
+    # (pid, filename) of the databases with a known schema
+    SCHEMAS = set()
+    CONNECTIONS_LOCK = Lock()
+
+    def __init__(self, path):
+        IBackend.__init__(self, path)
+        self.filename = os.path.abspath(os.path.join(self.path, self.FILENAME))
+
+    def _get_connection(self):
+        # connections can not be used by other threads, or after a fork
+        key = (os.getpid(), thread.get_ident(), self.filename)
+        conn = self.CONNECTIONS.get(key)
+        if conn is None:
+            with self.CONNECTIONS_LOCK:
+                if not os.path.isdir(self.path):
+                    os.makedirs(self.path)
+                # closed by close_all() from the main thread
+                db = sqlite3.connect(self.filename, check_same_thread=False)
+                if key[::2] not in self.SCHEMAS:
+                    db.execute('CREATE TABLE IF NOT EXISTS objects ('
+                               'name TEXT PRIMARY KEY, data TEXT NOT NULL, mtime REAL NOT NULL)')
+                    db.commit()
+                    self.SCHEMAS.add(key[::2])
+                conn = self.CONNECTIONS[key] = [db, 0]
+        return conn
+
+    @property
+    def db(self):
+        return self._get_connection()[0]
+
+    def _commit(self):
+        db, transactions = self._get_connection()
+        if not transactions:
+            db.commit()
+
+    @classmethod
+    def close_all(cls):
+        """
+        Close the connections of the process.
+        """
+        pid = os.getpid()
+        with cls.CONNECTIONS_LOCK:
+            for key in cls.CONNECTIONS.keys():
+                # the ones inherited from the parent are not ours to close
+                if key[0] == pid:
+                    cls.CONNECTIONS.pop(key)[0].close()
+
+    @staticmethod
+    def normalize(data):
+        ndata = {}
+        for sec, items in data.iteritems():
+            ndata[sec] = {}
+            for key, value in items.iteritems():
+                if value is None:
+                    continue
+                if isinstance(value, str):
+                    value = value.decode('utf-8')
+                # RawConfigParser.optionxform
+                ndata[sec][key.lower()] = unicode(value)
+        return ndata
+
+    def read(self, name):
+        row = self.db.execute('SELECT data FROM objects WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        return self._load(row[0])
+
+    @staticmethod
+    def _load(dump):
+        data = ConfigDict()
+        # names are byte strings when read from an INI file
+        for sec, items in json.loads(dump).iteritems():
+            data[sec.encode('utf-8')] = dict([(k.encode('utf-8'), v) for k, v in items.iteritems()])
+        return data
+
+    def write(self, name, data):
+        self.db.execute('INSERT OR REPLACE INTO objects (name, data, mtime) VALUES (?, ?, ?)',
+                        (name, json.dumps(self.normalize(data)), time.time()))
+        self._commit()
+
+    def read_many(self, names):
+        objects = dict([(name, (None, None)) for name in names])
+        names = list(names)
+        # stay under the maximum number of SQL variables
+        for i in xrange(0, len(names), 500):
+            chunk = names[i:i + 500]
+            rows = self.db.execute('SELECT name, mtime, data FROM objects WHERE name IN (%s)'
+                                   % ', '.join('?' * len(chunk)), chunk)
+            for name, mtime, data in rows.fetchall():
+                objects[name.encode('utf-8')] = (mtime, self._load(data))
+        return objects
+
+    def get_mtime(self, name):
+        row = self.db.execute('SELECT mtime FROM objects WHERE name = ?', (name,)).fetchone()
+        if row is not None:
+            return row[0]
+
+    def remove(self, name):
+        cursor = self.db.execute('DELETE FROM objects WHERE name = ?', (name,))
+        if not cursor.rowcount:
+            # like os.unlink() in FileBackend
+            raise OSError(errno.ENOENT, 'No such object: %s' % name)
+        self._commit()
+
+    def iter_names(self, dirname):
+        prefix = dirname + '/'
+        rows = self.db.execute('SELECT name FROM objects WHERE substr(name, 1, ?) = ? ORDER BY name',
+                               (len(prefix), prefix))
+        for row in rows.fetchall():
+            yield row[0][len(prefix):].encode('utf-8')
+
+    @contextmanager
+    def transaction(self):
+        conn = self._get_connection()
+        conn[1] += 1
+        try:
+            yield
+        except:
+            conn[1] -= 1
+            if not conn[1]:
+                conn[0].rollback()
+            raise
+        else:
+            conn[1] -= 1
+            if not conn[1]:
+                conn[0].commit()
+
+atexit.register(SQLiteBackend.close_all)
+
+
+BACKENDS = {'file': FileBackend,
+            'sqlite': SQLiteBackend,
+           }
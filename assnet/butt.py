@@ -51,6 +51,8 @@ class Butt(object):
         self.plugins = {}
         for existing_plugin_name in self.iter_existing_plugin_names():
             self.load_plugin(existing_plugin_name)
+        if self.router:
+            self.router.compile()
 
     def load_plugin(self, plugin_name):
         package_name = 'assnet.plugins.%s' % plugin_name
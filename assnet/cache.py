@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2011 Romain Bignon, Laurent Bachelier
+#
+# This file is part of assnet.
+#
+# assnet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# assnet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with assnet. If not, see <http://www.gnu.org/licenses/>.
+
+
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+
+__all__ = ['LRUCache']
+
+
+class LRUCache(object):
+    """
+    Thread-safe mapping keeping at most size entries.
+    When full, the least recently used entry is dropped.
+    With ttl, entries also expire after ttl seconds, or sooner if they
+    are set with their own ttl.
+    """
+
+    def __init__(self, size, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            if self.ttl is not None:
+                if value[0] < time():
+                    return default
+            # move it to the most recent position
+            self._data[key] = value
+            return value[1] if self.ttl is not None else value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data.pop(key, None)
+            if self.ttl is not None:
+                if ttl is None or ttl > self.ttl:
+                    ttl = self.ttl
+                value = (time() + ttl, value)
+            self._data[key] = value
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data.pop(key)
+            return value[1] if self.ttl is not None else value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2011 Romain Bignon, Laurent Bachelier
+#
+# This file is part of assnet.
+#
+# assnet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# assnet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with assnet. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+import os
+import json
+import hashlib
+from threading import Lock
+
+from .cache import LRUCache
+
+
+__all__ = ['DataPaths', 'AssetBundles']
+
+
+class DataPaths(object):
+    """
+    Find the data files (assets and templates) of a list of data directories.
+    When several directories have the same file, the first one wins.
+    The files are indexed once; use get() to share the instances.
+    Assets are also hashed, so their URLs can change with their contents.
+    """
+    KINDS = ('assets', 'templates')
+
+    INSTANCES = {}
+    INSTANCES_LOCK = Lock()
+
+    @classmethod
+    def get(cls, paths):
+        paths = tuple(paths)
+        with cls.INSTANCES_LOCK:
+            instance = cls.INSTANCES.get(paths)
+            if instance is None:
+                instance = cls.INSTANCES[paths] = cls(paths)
+            return instance
+
+    def __init__(self, paths):
+        self.paths = []
+        for path in paths:
+            if path not in self.paths:
+                self.paths.append(path)
+        self.paths = tuple(self.paths)
+        self.index = {}
+        for kind in self.KINDS:
+            self.index[kind] = self._build_index(kind)
+        # names to ((mtime, size), hash) tuples
+        self.hashes = {}
+        for name, realpath in self.index['assets'].iteritems():
+            self.hashes[name] = self._hash(realpath)
+
+    def _hash(self, realpath):
+        # stat first, so a change during the read is seen next time
+        st = os.stat(realpath)
+        with open(realpath, 'rb') as fp:
+            return ((st.st_mtime, st.st_size), hashlib.sha1(fp.read()).hexdigest()[:12])
+
+    def _build_index(self, kind):
+        index = {}
+        # last directories first, so the first ones override them
+        for dirpath in reversed(self.get_dirs(kind)):
+            for root, dirs, files in os.walk(dirpath):
+                for filename in files:
+                    realpath = os.path.join(root, filename)
+                    index[os.path.relpath(realpath, dirpath)] = realpath
+        return index
+
+    def get_dirs(self, kind):
+        return [os.path.join(path, kind) for path in self.paths]
+
+    def find(self, kind, name):
+        """
+        Get the real path of a data file, or None if it does not exist.
+        """
+        return self.index[kind].get(name)
+
+    def get_asset_hash(self, name):
+        """
+        Get the hash of the contents of an asset, or None if it does not exist.
+        It is computed again if the asset changed since it was indexed.
+        """
+        realpath = self.find('assets', name)
+        if realpath is None:
+            return None
+        try:
+            st = os.stat(realpath)
+        except OSError:
+            return None
+        entry = self.hashes.get(name)
+        if entry is None or entry[0] != (st.st_mtime, st.st_size):
+            try:
+                entry = self.hashes[name] = self._hash(realpath)
+            except (IOError, OSError):
+                return None
+        return entry[1]
+
+
+class AssetBundles(object):
+    """
+    Concatenated assets, built by "asn assets build" in the assets cache
+    of a storage. They are named after the hash of their contents.
+    The manifest tells which bundle to use for a list of assets, with
+    the hashes of the assets it was built from: bundles are only used
+    while they are the same.
+    """
+    MANIFESTS = LRUCache(100)
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.cachedir = os.path.join(storage.path, 'assets_cache')
+        self.manifest_path = os.path.join(self.cachedir, 'bundles.json')
+
+    def get_manifest(self):
+        try:
+            mtime = os.path.getmtime(self.manifest_path)
+        except OSError:
+            return {}
+        cached = self.MANIFESTS.get(self.manifest_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(self.manifest_path, 'rb') as fp:
+                manifest = json.load(fp)
+        except (IOError, ValueError):
+            return {}
+        self.MANIFESTS.set(self.manifest_path, (mtime, manifest))
+        return manifest
+
+    def save_manifest(self, manifest):
+        with open(self.manifest_path + '.tmp', 'wb') as fp:
+            json.dump(manifest, fp, indent=1, sort_keys=True)
+        os.rename(self.manifest_path + '.tmp', self.manifest_path)
+
+    @staticmethod
+    def get_key(names):
+        return ' '.join(names)
+
+    def is_current(self, entry):
+        """
+        Check if the assets of a bundle did not change since it was built.
+        Entries of older manifests do not have their hashes.
+        """
+        if not isinstance(entry, dict):
+            return False
+        data = self.storage.data
+        for name, asset_hash in entry['assets'].iteritems():
+            if data.get_asset_hash(name) != asset_hash:
+                return False
+        return True
+
+    def get_names(self, names):
+        """
+        Get the assets to use instead of a list of assets:
+        its bundle if it was built and is up to date, or the same list.
+        """
+        entry = self.get_manifest().get(self.get_key(names))
+        if entry and self.is_current(entry):
+            return [entry['bundle']]
+        return names
+
+    def iter_entries(self, name):
+        for entry in self.get_manifest().itervalues():
+            if isinstance(entry, dict) and entry['bundle'] == name:
+                yield entry
+
+    def find(self, name):
+        """
+        Get the real path of a bundle, or None if it is not known.
+        Outdated bundles are still found, for pages linking to them.
+        """
+        for entry in self.iter_entries(name):
+            return os.path.join(self.cachedir, name)
+
+    def is_fingerprinted(self, name):
+        """
+        Check if a bundle has the contents of its assets.
+        """
+        return any(self.is_current(entry) for entry in self.iter_entries(name))
+
+    def build(self, data, names):
+        """
+        Concatenate assets, and return the bundle path.
+        Missing assets are ignored.
+        """
+        contents = []
+        for name in names:
+            realpath = data.find('assets', name)
+            if realpath:
+                with open(realpath, 'rb') as fp:
+                    contents.append(fp.read())
+        contents = '\n'.join(contents)
+        ext = os.path.splitext(names[0])[1]
+        path = os.path.join(self.cachedir, hashlib.sha1(contents).hexdigest()[:12] + ext)
+        with open(path, 'wb') as fp:
+            fp.write(contents)
+        return path
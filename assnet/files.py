@@ -20,6 +20,8 @@
 
 import re
 import os
+import errno
+import stat
 import posixpath
 import hashlib
 import mimetypes
@@ -28,7 +30,75 @@ from datetime import datetime
 
 from .obj import IObject
 
-__all__ = ['File']
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+__all__ = ['File', 'iter_dir', 'get_fingerprint']
+
+
+def iter_dir(path):
+    """
+    Get the entries of a directory sorted by name,
+    as (name, stat, is_symlink) tuples.
+    stat follows symlinks, and is None for broken ones.
+    It uses scandir when available to avoid extra system calls.
+    """
+    if scandir is not None:
+        entries = sorted([(entry.name, entry) for entry in scandir(path)])
+        for name, entry in entries:
+            try:
+                st = entry.stat()
+            except OSError:
+                st = None
+            yield (name, st, entry.is_symlink())
+    else:
+        for name in sorted(os.listdir(path)):
+            filepath = os.path.join(path, name)
+            try:
+                st = os.lstat(filepath)
+                is_symlink = stat.S_ISLNK(st.st_mode)
+                if is_symlink:
+                    st = os.stat(filepath)
+            except OSError:
+                st = None
+            yield (name, st, is_symlink)
+
+
+def get_fingerprint(path, recursive=False, exclude=None):
+    """
+    Cheaply identify the state of a file, or of a directory and its entries
+    (of its whole tree if recursive), from their names, sizes and mtimes.
+    Symlinked directories are not followed, and the exclude path is ignored.
+    Returns a (digest, last mtime) tuple.
+    """
+    st = os.stat(path)
+    h = hashlib.sha1(repr((st.st_size, st.st_mtime)))
+    mtime = st.st_mtime
+    if stat.S_ISDIR(st.st_mode):
+        dirs = [path]
+        while dirs:
+            dirpath = dirs.pop()
+            try:
+                entries = list(iter_dir(dirpath))
+            except OSError:
+                continue
+            for name, st, is_symlink in entries:
+                entrypath = os.path.join(dirpath, name)
+                if entrypath == exclude:
+                    continue
+                if st is None:
+                    h.update(repr(entrypath))
+                    continue
+                h.update(repr((entrypath, st.st_size, st.st_mtime, is_symlink)))
+                mtime = max(mtime, st.st_mtime)
+                if recursive and stat.S_ISDIR(st.st_mode) and not is_symlink:
+                    dirs.append(entrypath)
+    return (h.hexdigest(), mtime)
 
 
 class File(IObject):
@@ -70,6 +140,9 @@ class File(IObject):
         self.view = None
         self.mimetype = None
         self.perms = {}
+        self._realpath = None
+        self._stat = None
+        self._islink = None
         IObject.__init__(self, storage)
 
     def to_class(self, cls):
@@ -78,7 +151,11 @@ class File(IObject):
         That class should inherit from File.
         This is useful for plugins.
         """
-        return cls(self.storage, self.path)
+        f = cls(self.storage, self.path)
+        f._realpath = self._realpath
+        f._stat = self._stat
+        f._islink = self._islink
+        return f
 
     def __str__(self):
         return self.path
@@ -129,13 +206,47 @@ class File(IObject):
         return self.storage.get_file(posixpath.dirname(self.path))
 
     def get_realpath(self):
-        return os.path.realpath(os.path.join(self.storage.path, '..', self.path[1:]))
+        if self._realpath is None:
+            self._realpath = os.path.realpath(os.path.join(self.storage.path, '..', self.path[1:]))
+        return self._realpath
+
+    def get_stat(self):
+        """
+        Get the stat of the real file, or None if it does not exist.
+        It is only done once, use refresh() if the file could have changed.
+        """
+        if self._stat is None:
+            try:
+                self._stat = os.stat(self.get_realpath())
+            except OSError:
+                self._stat = False
+        return self._stat or None
+
+    def set_stat(self, st):
+        """
+        Provide the stat of the real file, if it was already known.
+        """
+        self._stat = st if st is not None else False
+
+    def refresh(self):
+        """
+        Forget everything known about the real file.
+        """
+        self._realpath = None
+        self._stat = None
+        self._islink = None
+
+    def _get_existing_stat(self):
+        st = self.get_stat()
+        if st is None:
+            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), self.get_realpath())
+        return st
 
     def get_size(self):
-        return os.path.getsize(self.get_realpath())
+        return self._get_existing_stat().st_size
 
     def get_mtime(self):
-        return datetime.fromtimestamp(os.path.getmtime(self.get_realpath()))
+        return datetime.fromtimestamp(self._get_existing_stat().st_mtime)
 
     def get_human_size(self):
         size = self.get_size()
@@ -149,13 +260,23 @@ class File(IObject):
         """
         Tests if the real file exists (not the File storage object)
         """
-        return os.path.exists(self.get_realpath())
+        return self.get_stat() is not None
+
+    def islink(self):
+        """
+        Tests if the file itself is a symbolic link.
+        """
+        if self._islink is None:
+            self._islink = os.path.islink(os.path.join(self.storage.path, '..', self.path[1:]))
+        return self._islink
 
     def isdir(self):
-        return os.path.isdir(self.get_realpath())
+        st = self.get_stat()
+        return st is not None and stat.S_ISDIR(st.st_mode)
 
     def isfile(self):
-        return os.path.isfile(self.get_realpath())
+        st = self.get_stat()
+        return st is not None and stat.S_ISREG(st.st_mode)
 
     def get_object_type(self):
         if self.isdir():
@@ -165,9 +286,16 @@ class File(IObject):
 
     def iter_children(self):
         if self.isdir():
-            filenames = sorted(os.listdir(self.get_realpath()))
-            for filename in filenames:
-                yield self.storage.get_file(posixpath.join("/", self.path, filename))
+            realpath = self.get_realpath()
+            entries = list(iter_dir(realpath))
+            children = self.storage.get_files(
+                [posixpath.join("/", self.path, filename) for filename, st, is_symlink in entries])
+            for f, (filename, st, is_symlink) in zip(children, entries):
+                f.set_stat(st)
+                f._islink = is_symlink
+                if not is_symlink:
+                    f._realpath = os.path.join(realpath, filename)
+                yield f
 
     def get_name(self):
         return posixpath.basename(self.path)
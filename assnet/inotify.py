@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2011 Romain Bignon, Laurent Bachelier
+#
+# This file is part of assnet.
+#
+# assnet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# assnet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with assnet. If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+import errno
+import struct
+import ctypes
+import ctypes.util
+
+
+__all__ = ['Inotify', 'INOTIFY_SUPPORT',
+           'IN_MODIFY', 'IN_ATTRIB', 'IN_CLOSE_WRITE', 'IN_MOVED_FROM',
+           'IN_MOVED_TO', 'IN_CREATE', 'IN_DELETE', 'IN_DELETE_SELF',
+           'IN_MOVE_SELF', 'IN_Q_OVERFLOW', 'IN_IGNORED', 'IN_ISDIR',
+           'IN_ONLYDIR', 'IN_DONT_FOLLOW', 'IN_EXCL_UNLINK']
+
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0x00080000
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        return ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    except OSError:
+        return None
+
+_libc = _load_libc()
+
+INOTIFY_SUPPORT = _libc is not None and hasattr(_libc, 'inotify_init1')
+
+
+def _check(ret):
+    if ret < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return ret
+
+
+class Inotify(object):
+    """
+    Minimal binding of the Linux inotify API.
+    Watches are not recursive: each directory has to be added.
+    """
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self):
+        if not INOTIFY_SUPPORT:
+            raise OSError(errno.ENOSYS, 'inotify is not supported')
+        self.fd = _check(_libc.inotify_init1(IN_CLOEXEC))
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        """
+        Returns the watch descriptor, which is the same if the
+        path was already watched.
+        """
+        if isinstance(path, unicode):
+            path = path.encode(sys.getfilesystemencoding() or 'utf-8')
+        return _check(_libc.inotify_add_watch(self.fd, ctypes.c_char_p(path),
+                                              ctypes.c_uint32(mask)))
+
+    def rm_watch(self, wd):
+        _check(_libc.inotify_rm_watch(self.fd, wd))
+
+    def read(self):
+        """
+        Wait for events.
+        Returns a list of (wd, mask, cookie, name) tuples, name being
+        an empty string for events on the watched directory itself.
+        """
+        while True:
+            try:
+                data = os.read(self.fd, self.BUFFER_SIZE)
+                break
+            except OSError, e:
+                if e.errno != errno.EINTR:
+                    raise
+        events = []
+        pos = 0
+        while pos + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            name = data[pos:pos + length].rstrip('\0')
+            pos += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
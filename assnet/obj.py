@@ -43,12 +43,17 @@ class IObject(object):
     def read(self):
         mtime = self.storage._get_mtime(self._confname)
         if self._mtime is None or self._mtime != mtime or self.is_modified():
-            data = self.storage._read(self._confname)
-            self._mtime = mtime
-            self.exists = data is not None
-            self.data = data or ConfigDict()
-            self._postread()
-            self._old_data = deepcopy(self.data)
+            self._load(mtime, self.storage._read(self._confname))
+
+    def _load(self, mtime, data):
+        """
+        Set the data read from the storage.
+        """
+        self._mtime = mtime
+        self.exists = data is not None
+        self.data = data or ConfigDict()
+        self._postread()
+        self._old_data = deepcopy(self.data)
 
     def save(self):
         self._prewrite()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2011 Romain Bignon, Laurent Bachelier
+#
+# This file is part of assnet.
+#
+# assnet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# assnet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with assnet. If not, see <http://www.gnu.org/licenses/>.
+
+
+import posixpath
+
+
+__all__ = ['PermsResolver']
+
+
+class PermsResolver(object):
+    """
+    Compute the effective permissions of an user on files.
+    Results are remembered by path, so files sharing the same
+    parent directories only read their configurations once.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.cache = {}
+
+    def get_perms(self, f):
+        """
+        Get the permissions bitmask of the user on a File.
+        """
+        cached = self.cache.get(f.path)
+        # the file itself could have been altered since
+        if cached is not None and cached[0] == f.perms:
+            return cached[1]
+
+        perms = self.user.match_perms(f)
+        if perms is None:
+            if f.path == '':
+                perms = 0
+            else:
+                perms = self.get_path_perms(f.storage, posixpath.dirname(f.path))
+        self.cache[f.path] = (dict(f.perms), perms)
+        return perms
+
+    def get_path_perms(self, storage, path):
+        """
+        Like get_perms, but only reads the File if it is not known yet.
+        """
+        if path == '/':
+            path = ''
+        cached = self.cache.get(path)
+        if cached is not None:
+            return cached[1]
+        return self.get_perms(storage.get_file(path))
+
+    def has_perms(self, f, perm):
+        return self.get_perms(f) & perm
+
+    def clear(self):
+        self.cache.clear()
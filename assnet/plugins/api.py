@@ -18,12 +18,21 @@
 # along with assnet. If not, see <http://www.gnu.org/licenses/>.
 
 
+import os
+import re
+import stat
 import json
+import heapq
+from itertools import islice
+from HTMLParser import HTMLParser
+import posixpath
 from dateutil import tz
 import PyRSS2Gen
 from mako.filters import html_escape
 
 from assnet.plugin import Plugin
+from assnet.cache import LRUCache
+from assnet.files import iter_dir
 
 from assnet.routes import View
 from assnet.server import ViewAction
@@ -46,12 +55,23 @@ class InfoAction(ViewAction):
 
 
 class JsonInfoAction(InfoAction):
+    def get_validators(self):
+        return self.get_file_validators()
+
     def get(self):
         self.ctx.res.content_type = 'application/json'
         self.ctx.res.body = json.dumps(self.get_fileinfo(self.ctx.file))
 
 
 class JsonListAction(InfoAction):
+    CACHE_RESPONSE = True
+
+    def get_validators(self):
+        return self.get_file_validators()
+
+    def get_user_identity(self):
+        return self.get_perms_fingerprint()
+
     def get(self):
         files = dict()
         for f in self.ctx.iter_files():
@@ -64,6 +84,14 @@ class JsonListAction(InfoAction):
 
 
 class TextListAction(ViewAction):
+    CACHE_RESPONSE = True
+
+    def get_validators(self):
+        return self.get_file_validators()
+
+    def get_user_identity(self):
+        return self.get_perms_fingerprint()
+
     def get(self):
         filenames = []
         for f in self.ctx.iter_files():
@@ -74,53 +102,119 @@ class TextListAction(ViewAction):
 
         self.ctx.res.content_type = 'text/plain'
         self.ctx.res.charset = 'UTF-8'
-        self.ctx.res.body = '\n'.join(filenames)
+        self.ctx.res.body = u'\n'.join(filenames).encode('utf-8')
 
 class RssListAction(InfoAction):
+    # links have the authkey of the user, so responses are not shared
+    # between users with the same permissions
     NB_ENTRIES = 20
-
-    class SortableFile(object):
-        def __init__(self, f):
-            self.obj = f
-            self.mtime = f.get_mtime().replace(tzinfo=tz.tzlocal()).astimezone(tz.tzutc())
-
-        def __lt__(self, o):
-            return self.mtime < o.mtime
+    # descriptions of text files are cut after this many bytes
+    EXCERPT_SIZE = 4096
+    CACHE_RESPONSE = True
+    # (realpath, mtime, size, mimetype): description
+    EXCERPTS = LRUCache(1000)
+    # tags, with the contents of scripts and styles, and a cut tag at the end
+    TAGS_REGEXP = re.compile(r'<(script|style)\b.*?</\1\s*>|<!--.*?-->|<[^>]*>|<[^>]*$',
+                             re.DOTALL | re.IGNORECASE)
+
+    @staticmethod
+    def get_utc_mtime(f):
+        return f.get_mtime().replace(tzinfo=tz.tzlocal()).astimezone(tz.tzutc())
+
+    def get_validators(self):
+        index = self.get_recent_index()
+        if index is not None:
+            return self.get_index_validators(index)
+        return self.get_file_validators(recursive=True)
+
+    def iter_recent_files(self, nb):
+        """
+        Get the nb last modified files of the tree the user can see,
+        newest first. Like Context.iter_files_recursively(), but files
+        are only read and checked for permissions if they are recent enough.
+        With a recent changes index, the tree is not walked at all.
+        """
+        index = self.get_recent_index()
+        if index is not None:
+            return list(islice((f for f in self.ctx.iter_recent_files(index) if not f.isdir()), nb))
+        storage = self.ctx.storage
+        user = self.ctx.user
+        # (mtime, path, File), the oldest first
+        heap = []
+        dirs = [(self.ctx.file, self.ctx.file.get_realpath())]
+        while dirs:
+            d, realpath = dirs.pop()
+            try:
+                entries = list(iter_dir(realpath))
+            except OSError:
+                continue
+            listable = user.has_perms(d, d.PERM_LIST)
+            for name, st, is_symlink in entries:
+                if st is None:
+                    continue
+                path = posixpath.join('/', d.path, name)
+                if stat.S_ISDIR(st.st_mode):
+                    if not is_symlink:
+                        dirs.append((storage.get_file(path), os.path.join(realpath, name)))
+                elif listable and (len(heap) < nb or st.st_mtime > heap[0][0]):
+                    f = storage.get_file(path)
+                    f.set_stat(st)
+                    if user.has_perms(f, f.PERM_IN):
+                        if len(heap) < nb:
+                            heapq.heappush(heap, (st.st_mtime, path, f))
+                        else:
+                            heapq.heapreplace(heap, (st.st_mtime, path, f))
+        return [entry[2] for entry in sorted(heap, reverse=True)]
+
+    def get_excerpt(self, f, mimetype):
+        """
+        Get the beginning of a text file, as HTML.
+        """
+        st = f.get_stat()
+        key = (f.get_realpath(), st.st_mtime, st.st_size, mimetype)
+        description = self.EXCERPTS.get(key)
+        if description is None:
+            with open(f.get_realpath(), 'r') as fp:
+                data = fp.read(self.EXCERPT_SIZE + 1)
+            description = data[:self.EXCERPT_SIZE].decode('utf-8', 'ignore')
+            if 'html' in mimetype:
+                if len(data) > self.EXCERPT_SIZE:
+                    # only keep the text, a cut document could leave tags open
+                    text = HTMLParser().unescape(self.TAGS_REGEXP.sub(u' ', description))
+                    description = u'<p>%s…</p>' % html_escape(u' '.join(text.split()))
+            else:
+                if len(data) > self.EXCERPT_SIZE:
+                    description += u'…'
+                description = u'<pre>%s</pre>' % html_escape(description)
+            self.EXCERPTS.set(key, description)
+        return description
 
     def get(self):
-        base_dir = self.SortableFile(self.ctx.file)
-        files = []
-        for f in self.ctx.iter_files_recursively():
-            if not f.isdir():
-                files.append(self.SortableFile(f))
-        files.sort(reverse=True)
+        files = self.iter_recent_files(self.NB_ENTRIES)
 
         root_url = build_root_url(self.ctx.storage)
         items = []
-        for f in files[:self.NB_ENTRIES]:
-            link = build_url(root_url, f.obj, user=self.ctx.user)
+        for f in files:
+            link = build_url(root_url, f, user=self.ctx.user)
             description = None
-            mimetype = f.obj.get_mimetype()
-            if mimetype is not None and self.ctx.user.has_perms(f.obj, f.obj.PERM_READ):
+            mimetype = f.get_mimetype()
+            if mimetype is not None and self.ctx.user.has_perms(f, f.PERM_READ):
                 if mimetype.startswith('image'):
                     description = '<img src="%s" />' % unicode(link.setvars(view='thumbnail', thumb_size=200))
                 elif mimetype.startswith('text'):
-                    with open(f.obj.get_realpath(), 'r') as fp:
-                        description = fp.read()
-                        if not 'html' in mimetype:
-                            description = '<pre>%s</pre>' % html_escape(description.decode('utf-8'))
-            title = f.obj.path[len(self.ctx.file.path):].replace('_', ' ').lstrip('/').replace('/', ' / ')
+                    description = self.get_excerpt(f, mimetype)
+            title = f.path[len(self.ctx.file.path):].replace('_', ' ').lstrip('/').replace('/', ' / ')
             if title.endswith('.html') or title.endswith('.txt'):
                 title = title.rsplit('.', 1)[0]
             items.append(PyRSS2Gen.RSSItem(title=title,
                                            link=str(link),
                                            description=description,
-                                           guid=PyRSS2Gen.Guid(f.obj.path),
-                                           pubDate=f.mtime))
+                                           guid=PyRSS2Gen.Guid(f.path),
+                                           pubDate=self.get_utc_mtime(f)))
         rss = PyRSS2Gen.RSS2(title='Updates of %s/' % self.ctx.file.path,
                              link='%s' % build_url(root_url, self.ctx.file, user=self.ctx.user),
                              description='Last updates of %s/' % self.ctx.file.path,
-                             lastBuildDate=files[0].mtime if len(files) else base_dir.mtime,
+                             lastBuildDate=self.get_utc_mtime(files[0] if files else self.ctx.file),
                              items=items)
         self.ctx.res.content_type = 'application/rss+xml'
         self.ctx.res.charset = 'UTF-8'
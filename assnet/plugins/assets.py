@@ -21,81 +21,217 @@
 from contextlib import closing
 import os
 import re
+import sys
+import mimetypes
 from gzip import GzipFile
 from mimetypes import guess_type
+from tempfile import NamedTemporaryFile
 
 from assnet.plugin import Plugin
-from assnet.server import Action, FileApp
+from assnet.cmd import Command
+from assnet.butt import Butt
+from assnet.data import AssetBundles
+from assnet.routes import Router
+from assnet.server import Action, FileApp, Context
 
 from paste.httpheaders import CACHE_CONTROL, CONTENT_DISPOSITION
 from webob.exc import HTTPNotFound, HTTPPreconditionFailed
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 
 __all__ = ['AssetsPlugin']
 
 
+mimetypes.encodings_map.setdefault('.br', 'br')
+
+
+def compress_asset(realpath, dest, ext):
+    """
+    Write the compressed version of an asset (ext is ".gz" or ".br"),
+    with the same mtime.
+    """
+    mtime = os.path.getmtime(realpath)
+    destdir = os.path.dirname(dest)
+    if not os.path.isdir(destdir):
+        try:
+            os.makedirs(destdir)
+            os.chmod(destdir, 0770)
+        except OSError, e:
+            # ignore race condition when multiple assets
+            # are asked at the same
+            if not e.errno == 17:
+                raise e
+    # write then rename, so concurrent requests never serve a partial file
+    with open(realpath, 'rb') as f_in:
+        with NamedTemporaryFile(dir=destdir, delete=False) as f_out:
+            if ext == '.br':
+                f_out.write(brotli.compress(f_in.read(), quality=11))
+            else:
+                with closing(GzipFile(filename='', mode='wb', compresslevel=9,
+                                      fileobj=f_out, mtime=int(mtime))) as gz:
+                    gz.writelines(f_in)
+    os.utime(f_out.name, (mtime, mtime))
+    os.rename(f_out.name, dest)
+
+
+def is_compressible(filename):
+    mimetype = guess_type(filename)[0]
+    if mimetype is None:
+        return False
+    return mimetype.startswith('application/') or mimetype.startswith('text/')
+
+
 class AssetAction(Action):
     SANITIZE_REGEXP = re.compile(r'^[\w\-]+(?:\.[\w\-]+)+$')
+    ONE_YEAR = 365 * 24 * 60 * 60
 
     def get(self):
         filename = self.ctx.req.GET.get('file')
         if self.SANITIZE_REGEXP.match(filename):
             realpath = self.find_file(filename)
             if realpath:
-                if self.accepts_gzip() and self.compressible(filename):
-                    realpath = self.gzip_file(realpath)
+                compressible = self.compressible(filename)
+                if compressible:
+                    realpath = self.find_encoded(realpath)
                 self.ctx.res = FileApp(realpath)
-                self.ctx.res.cache_control(public=True, max_age=CACHE_CONTROL.ONE_DAY)
+                if self.is_fingerprinted(filename):
+                    # the URL changes with the contents
+                    CACHE_CONTROL.update(self.ctx.res.headers,
+                        *CACHE_CONTROL.compose(public=True, max_age=self.ONE_YEAR) + ['immutable'])
+                else:
+                    self.ctx.res.cache_control(public=True, max_age=CACHE_CONTROL.ONE_DAY)
+                if compressible:
+                    self.ctx.res.headers.append(('Vary', 'Accept-Encoding'))
                 CONTENT_DISPOSITION.apply(self.ctx.res.headers, inline=True, filename=filename)
                 return
             raise HTTPNotFound()
         raise HTTPPreconditionFailed()
 
     def find_file(self, filename):
-            paths = [os.path.join(path, 'assets') for path in self.ctx.storage.DATA_PATHS]
-            for path in paths:
-                realpath = os.path.join(path, filename)
-                if os.path.isfile(realpath):
-                    return realpath
+        return self.ctx.storage.data.find('assets', filename) \
+            or AssetBundles(self.ctx.storage).find(filename)
+
+    def is_fingerprinted(self, filename):
+        """
+        Check if the URL has the hash of the current asset contents.
+        Bundles are always named after it.
+        """
+        asset_hash = self.ctx.storage.data.get_asset_hash(filename)
+        if asset_hash is None:
+            return AssetBundles(self.ctx.storage).is_fingerprinted(filename)
+        return self.ctx.req.GET.get('v') == asset_hash
 
     def accepts_gzip(self):
         return 'gzip' in self.ctx.req.accept_encoding
 
+    def accepts_brotli(self):
+        return 'br' in self.ctx.req.accept_encoding
+
     def compressible(self, filename):
-        mimetype = guess_type(filename)[0]
-        return mimetype.startswith('application/') or mimetype.startswith('text/')
+        return is_compressible(filename)
+
+    def find_encoded(self, realpath):
+        """
+        Get the best version of an asset the client accepts.
+        Brotli versions are only used if built by "asn assets build".
+        """
+        if self.accepts_brotli():
+            realpath_br = self.find_compressed(realpath, '.br')
+            if realpath_br:
+                return realpath_br
+        if self.accepts_gzip():
+            return self.gzip_file(realpath)
+        return realpath
+
+    def find_compressed(self, realpath, ext):
+        """
+        Find an up to date compressed version of an asset, or return None.
+        """
+        # first look if there is a (read-only) compressed version of the asset
+        # these files may be created by installers (or "asn assets build"
+        # for bundles) and are supposed to be always up to date
+        if os.path.exists(realpath + ext):
+            return realpath + ext
+
+        # then look for a local cache of that asset
+        dest = self.get_cache_path(realpath, ext)
+        try:
+            # utime() keeps microseconds at best, but seconds are not enough
+            # when the response is cached for a year
+            if abs(os.path.getmtime(realpath) - os.path.getmtime(dest)) < 0.001:
+                return dest
+        except OSError:
+            pass
+
+    def get_cache_path(self, realpath, ext):
+        cachedir = os.path.join(self.ctx.storage.path, 'assets_cache')
+        return os.path.join(cachedir, os.path.basename(realpath) + ext)
 
     def gzip_file(self, realpath):
-        filename = os.path.basename(realpath)
-        mtime = int(os.path.getmtime(realpath))
+        dest = self.find_compressed(realpath, '.gz')
+        if dest is None:
+            # create the local cache
+            dest = self.get_cache_path(realpath, '.gz')
+            compress_asset(realpath, dest, '.gz')
+        return dest
 
-        # first look if there is a (read-only) gzipped version of the asset
-        # these files may be created by installers and are supposed to be
-        # always up to date
-        realpath_gz = realpath + '.gz'
-        if os.path.exists(realpath_gz):
-            return realpath_gz
 
-        # then look for a local cache of that asset, if not present, create it
-        cachedir = os.path.join(self.ctx.storage.path, 'assets_cache')
-        dest = os.path.join(cachedir, filename + '.gz')
-        if not os.path.exists(dest) or mtime != int(os.path.getmtime(dest)):
-            if not os.path.isdir(cachedir):
-                try:
-                    os.makedirs(cachedir)
-                    os.chmod(cachedir, 0770)
-                except OSError, e:
-                    # ignore race condition when multiple assets
-                    # are asked at the same
-                    if not e.errno == 17:
-                        raise e
-            with open(realpath, 'rb') as f_in:
-                with closing(GzipFile(dest, 'wb')) as f_out:
-                    f_out.writelines(f_in)
-            os.utime(dest, (mtime, mtime))
-        return dest
+class AssetsBuildCmd(Command):
+    DESCRIPTION = 'Build the asset bundles and compress the assets'
+
+    def iter_lists(self):
+        """
+        Get the lists of assets of the pages, as they are requested by views.
+        """
+        butt = Butt(router=Router())
+        lists = set()
+        lists.add(tuple(Context.STYLESHEETS))
+        lists.add(tuple(Context.SCRIPTS))
+        for views in butt.router.views.itervalues():
+            for view, action in views:
+                lists.add(tuple(Context.STYLESHEETS + getattr(action, 'STYLESHEETS', [])))
+                lists.add(tuple(Context.SCRIPTS + getattr(action, 'SCRIPTS', [])))
+        return sorted(lists)
+
+    def cmd(self, args):
+        data = self.storage.data
+        bundles = AssetBundles(self.storage)
+        if not os.path.isdir(bundles.cachedir):
+            os.makedirs(bundles.cachedir)
+            os.chmod(bundles.cachedir, 0770)
+        exts = ['.gz', '.br'] if brotli else ['.gz']
+
+        manifest = {}
+        for names in self.iter_lists():
+            path = bundles.build(data, names)
+            for ext in exts:
+                compress_asset(path, path + ext, ext)
+            # to check that the bundle is still up to date
+            hashes = dict([(name, data.get_asset_hash(name)) for name in names])
+            manifest[bundles.get_key(names)] = {'bundle': os.path.basename(path),
+                                                'assets': hashes}
+            print '%s: %s' % (os.path.basename(path), ', '.join(names))
+
+        # also compress the assets requested alone
+        for name, realpath in sorted(data.index['assets'].iteritems()):
+            # skip the already compressed ones
+            if is_compressible(name) and guess_type(name)[1] is None:
+                for ext in exts:
+                    dest = os.path.join(bundles.cachedir, os.path.basename(realpath) + ext)
+                    compress_asset(realpath, dest, ext)
+
+        bundles.save_manifest(manifest)
+        if not brotli:
+            print >>sys.stderr, 'Warning: brotli is not available, only gzip versions were created.'
 
 
 class AssetsPlugin(Plugin):
     def init(self):
+        self.register_cli_command('assets', 'Manage the web assets')
+        self.register_cli_command('assets', 'build', AssetsBuildCmd)
+
         self.register_web_action('asset', AssetAction)
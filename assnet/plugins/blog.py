@@ -18,6 +18,7 @@
 # along with assnet. If not, see <http://www.gnu.org/licenses/>.
 
 
+from itertools import islice
 from mako.filters import html_escape
 
 from assnet.plugin import Plugin
@@ -38,6 +39,11 @@ class Post(object):
 
 
 class BlogAction(ViewAction):
+    STYLESHEETS = ['blog.css']
+
+    def get_validators(self):
+        return self.get_file_validators()
+
     def get(self):
         f = self.ctx.file
         post = Post()
@@ -55,12 +61,13 @@ class BlogAction(ViewAction):
 
         self.ctx.template_vars['categories'] = []
         self.ctx.template_vars['posts'] = [post]
-        self.ctx.template_vars['stylesheets'].append('blog.css')
         self.ctx.res.body = self.ctx.render('blog.html')
 
 
 class BlogListAction(ViewAction):
     NB_ENTRIES = 20
+    CACHE_RESPONSE = True
+    STYLESHEETS = ['blog.css']
 
     class SortableFile(object):
         def __init__(self, f):
@@ -70,16 +77,27 @@ class BlogListAction(ViewAction):
         def __lt__(self, o):
             return self.mtime < o.mtime
 
-    def get(self):
-        posts = []
-        categories = []
+    def get_validators(self):
+        index = self.get_recent_index()
+        if index is not None:
+            return self.get_index_validators(index)
+        return self.get_file_validators(recursive=True)
+
+    def get_recent_files(self):
+        index = self.get_recent_index()
+        if index is not None:
+            return [self.SortableFile(f) for f in islice(self.ctx.iter_recent_files(index), self.NB_ENTRIES)]
         files = []
         for f in self.ctx.iter_files_recursively():
             if f.path != self.ctx.file.path:
                 files.append(self.SortableFile(f))
         files.sort(reverse=True)
+        return files[:self.NB_ENTRIES]
 
-        for f in files[:self.NB_ENTRIES]:
+    def get(self):
+        posts = []
+        categories = []
+        for f in self.get_recent_files():
             if f.obj.isdir():
                 categories.append(f.obj)
                 continue
@@ -107,7 +125,6 @@ class BlogListAction(ViewAction):
 
         self.ctx.template_vars['categories'] = categories
         self.ctx.template_vars['posts'] = posts
-        self.ctx.template_vars['stylesheets'].append('blog.css')
         self.ctx.res.body = self.ctx.render('blog.html')
 
 
@@ -37,7 +37,11 @@ class ResolveCmd(Command):
         except GetConfigError, e:
             print >>sys.stderr, 'Error: %s' % e
             return 1
-        print '%s => %s' % (config, os.path.join(self.storage.path, config._get_confname()))
+        path = self.storage._get_path(config._get_confname())
+        if path is None:
+            print >>sys.stderr, 'Error: %s is not stored in a file.' % config
+            return 1
+        print '%s => %s' % (config, path)
 
 
 class ListConfigCmd(Command):
@@ -120,8 +124,15 @@ class EditConfigCmd(Command):
             print >>sys.stderr, 'Error: %s' % e
             return 1
 
-        return subprocess.call([os.environ.get('EDITOR', 'vi'),
-                    os.path.join(self.storage.path, config._get_confname())])
+        path = self.storage._get_path(config._get_confname())
+        if path is None:
+            print >>sys.stderr, 'Error: %s is not stored in a file, use "config set".' % config
+            return 1
+
+        try:
+            return subprocess.call([os.environ.get('EDITOR', 'vi'), path])
+        finally:
+            self.storage.touch()
 
 
 class GetConfigError(Exception):
@@ -429,6 +429,8 @@ class ContactsCleaner(ICleaner):
                 user.key = None
                 user.save()
                 print "%s: fixed empty key." % user._get_confname()
+        # the index could be outdated if users were edited by hand
+        self.storage.get_keysindex(build=False).rebuild()
 
     def gc(self):
         pass
@@ -68,6 +68,7 @@ class Event(object):
     def save(self):
         with open(self.f.get_realpath(), 'w') as fp:
             self._print(fp)
+        self.f.refresh()
 
         self.f.clear_user_perms()
         for username in self.users.iterkeys():
@@ -356,6 +357,11 @@ class EventsCmd(Command):
 
 
 class EventAction(ViewAction):
+    STYLESHEETS = ['event.css']
+
+    def get_validators(self):
+        return self.get_file_validators()
+
     def get(self, state=None):
         user_state = None
         error_message = None
@@ -388,7 +394,6 @@ class EventAction(ViewAction):
         self.ctx.template_vars['user_state'] = user_state
         self.ctx.template_vars['error_message'] = error_message
         self.ctx.template_vars['confirm_message'] = confirm_message
-        self.ctx.template_vars['stylesheets'].append('event.css')
         self.ctx.res.body = self.ctx.render('event.html')
 
     def delete(self):
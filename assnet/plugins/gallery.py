@@ -19,18 +19,150 @@
 
 
 import os
+import sys
+from multiprocessing import Pool
+from tempfile import NamedTemporaryFile
 from PIL import Image
 from paste.httpheaders import CACHE_CONTROL, CONTENT_DISPOSITION
 from mako.filters import html_escape
 from paste.url import URL
 
 from assnet.plugin import Plugin
+from assnet.cmd import Command
 from assnet.routes import View
 from assnet.server import ViewAction, FileApp
+from assnet.storage import Storage
 from assnet.files import File
 
 
-__all__ = ['GalleryPlugin']
+__all__ = ['GalleryPlugin', 'Thumbnailer']
+
+
+Image.init()
+WEBP_SUPPORT = 'WEBP' in Image.SAVE
+
+
+class Thumbnailer(object):
+    """
+    Create and find the thumbnails of images.
+    They are stored in the thumbnails/SIZE/ directory of the storage,
+    with the mtime of the original image.
+    """
+    # used by Media.get_thumb_url and DownloadThumbnailAction
+    SIZES = (200, 300)
+    # refuse to decode larger images, even after draft()
+    MAX_PIXELS = 64 * 1024 * 1024
+    EXIF_ORIENTATION = 0x0112
+    # transpositions to apply for each EXIF orientation
+    ORIENTATIONS = {2: (Image.FLIP_LEFT_RIGHT,),
+                    3: (Image.ROTATE_180,),
+                    4: (Image.FLIP_TOP_BOTTOM,),
+                    5: (Image.ROTATE_90, Image.FLIP_TOP_BOTTOM),
+                    6: (Image.ROTATE_270,),
+                    7: (Image.ROTATE_90, Image.FLIP_LEFT_RIGHT),
+                    8: (Image.ROTATE_90,),
+                   }
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.thumbdir = os.path.join(storage.path, 'thumbnails')
+
+    def can_handle(self, f):
+        mimetype = f.get_mimetype()
+        return mimetype is not None and mimetype.startswith('image') \
+            and mimetype != 'image/svg+xml'
+
+    def get_ext(self, f, webp=False):
+        """
+        Get the thumbnail format of an image.
+        Lossy images can use WebP, if asked and supported.
+        """
+        if f.get_mimetype() == 'image/jpeg':
+            return 'webp' if webp and WEBP_SUPPORT else 'jpg'
+        # use a lossless format in doubt
+        return 'png'
+
+    def get_exts(self, f):
+        return set([self.get_ext(f), self.get_ext(f, webp=True)])
+
+    def get_path(self, f, size, ext):
+        return os.path.join(self.thumbdir, str(size), '%s.%s' % (f.get_hash(), ext))
+
+    def is_fresh(self, f, size, ext):
+        try:
+            mtime = int(os.path.getmtime(self.get_path(f, size, ext)))
+        except OSError:
+            return False
+        return mtime == int(f.get_stat().st_mtime)
+
+    def build(self, f, size, ext):
+        """
+        Create the thumbnail if it is missing or outdated.
+        Returns its path.
+        """
+        thumbpath = self.get_path(f, size, ext)
+        if self.is_fresh(f, size, ext):
+            return thumbpath
+
+        mtime = int(f.get_stat().st_mtime)
+        thumbdir = os.path.dirname(thumbpath)
+        if not os.path.isdir(thumbdir):
+            try:
+                os.makedirs(thumbdir)
+                os.chmod(thumbdir, 0770)
+            except OSError, e:
+                # another process could have created it
+                if not e.errno == 17:
+                    raise e
+        with open(f.get_realpath(), 'rb') as fp:
+            img = self.make_thumbnail(Image.open(fp), size)
+            # write then rename, so concurrent requests never serve a partial file
+            with NamedTemporaryFile(dir=thumbdir, delete=False) as tfp:
+                if ext == 'jpg':
+                    img.save(tfp, 'jpeg', quality=95, progressive=True)
+                elif ext == 'webp':
+                    img.save(tfp, 'webp', quality=90)
+                else:
+                    img.save(tfp, 'png')
+        os.utime(tfp.name, (mtime, mtime))
+        os.rename(tfp.name, thumbpath)
+        return thumbpath
+
+    def remove(self, f):
+        """
+        Remove the thumbnails of a file, i.e. one which was deleted.
+        Returns the number of removed thumbnails.
+        """
+        count = 0
+        for size in self.SIZES:
+            for ext in ('jpg', 'webp', 'png'):
+                try:
+                    os.unlink(self.get_path(f, size, ext))
+                    count += 1
+                except OSError:
+                    pass
+        return count
+
+    def make_thumbnail(self, img, size):
+        orientation = self.get_orientation(img)
+        # let the JPEG decoder downscale, instead of decoding every pixel
+        img.draft('RGB', (size, size))
+        if img.size[0] * img.size[1] > self.MAX_PIXELS:
+            raise IOError('Image is too large (%dx%d)' % img.size)
+        img.thumbnail((size, size), Image.ANTIALIAS)
+        for method in self.ORIENTATIONS.get(orientation, ()):
+            img = img.transpose(method)
+        if img.mode not in ('RGB', 'RGBA', 'L', 'P'):
+            img = img.convert('RGB')
+        return img
+
+    def get_orientation(self, img):
+        try:
+            exif = img._getexif()
+        except (AttributeError, IOError, KeyError, IndexError, SyntaxError, ValueError):
+            return None
+        if exif:
+            return exif.get(self.EXIF_ORIENTATION)
 
 
 class DownloadThumbnailAction(ViewAction):
@@ -48,35 +180,83 @@ class DownloadThumbnailAction(ViewAction):
 
     def get(self):
         size = self._get_size()
-        thumbdir = os.path.join(self.ctx.storage.path, 'thumbnails')
         f = self.ctx.file
-
-        # use a lossless format in doubt
-        lossy = f.get_mimetype() == 'image/jpeg'
-        thumbext = 'jpg' if lossy else 'png'
-        thumbpath = os.path.join(thumbdir, str(size), '%s.%s' % (f.get_hash(), thumbext))
-        f.data['thumbnail']['ext'] = thumbext
-        f.save()
-
-        mtime = int(os.path.getmtime(f.get_realpath()))
-        if not os.path.exists(thumbpath) or mtime != int(os.path.getmtime(thumbpath)):
-            if not os.path.isdir(os.path.dirname(thumbpath)):
-                os.makedirs(os.path.dirname(thumbpath))
-                os.chmod(os.path.dirname(thumbpath), 0770)
-            with open(f.get_realpath(), 'rb') as fp:
-                img = Image.open(fp)
-                img.thumbnail((size, size), Image.BILINEAR)
-                with open(thumbpath, 'wb') as tfp:
-                    if lossy:
-                        img.save(tfp, 'jpeg', quality=95)
-                    else:
-                        img.save(tfp, 'png')
-            os.utime(thumbpath, (mtime, mtime))
+        thumbnailer = Thumbnailer(self.ctx.storage)
+        # browsers advertise WebP explicitly, do not rely on */*
+        ext = thumbnailer.get_ext(f, webp='image/webp' in self.ctx.req.headers.get('Accept', ''))
+        # usually already done by "thumbnails build"
+        thumbpath = thumbnailer.build(f, size, ext)
 
         self.ctx.res = FileApp(thumbpath)
         self.ctx.res.cache_control(private=True, max_age=CACHE_CONTROL.ONE_HOUR)
+        if len(thumbnailer.get_exts(f)) > 1:
+            self.ctx.res.headers.append(('Vary', 'Accept'))
         CONTENT_DISPOSITION.apply(self.ctx.res.headers, inline=True,
-            filename="%s_thumb_%s.%s" % (os.path.splitext(f.get_name())[0], size, thumbext))
+            filename="%s_thumb_%s.%s" % (os.path.splitext(f.get_name())[0], size, ext))
+
+
+def build_thumbnails(args):
+    """
+    Build the thumbnails of a file in all the standard sizes.
+    This is a function to be usable by a multiprocessing.Pool.
+    Returns an error message, or None.
+    """
+    storage_path, path = args
+    storage = Storage(storage_path)
+    f = storage.get_file(path)
+    thumbnailer = Thumbnailer(storage)
+    try:
+        for size in Thumbnailer.SIZES:
+            for ext in thumbnailer.get_exts(f):
+                thumbnailer.build(f, size, ext)
+    except (IOError, OSError), e:
+        return '%s: %s' % (path, e)
+
+
+class ThumbnailsBuildCmd(Command):
+    DESCRIPTION = 'Create the missing or outdated thumbnails of images'
+
+    @staticmethod
+    def configure_parser(parser):
+        parser.add_argument('path', nargs='?', default=None)
+        parser.add_argument('-j', '--jobs', type=int, default=1,
+                            help='Number of processes to use')
+
+    def iter_paths(self, path):
+        thumbnailer = Thumbnailer(self.storage)
+        storage_path = os.path.realpath(self.storage.path)
+        for root, directories, files in os.walk(path):
+            directories[:] = [d for d in directories if os.path.join(root, d) != storage_path]
+            for filename in files:
+                f = self.storage.get_file_from_realpath(os.path.join(root, filename))
+                if f and f.isfile() and thumbnailer.can_handle(f) and \
+                        not all([thumbnailer.is_fresh(f, size, ext)
+                                 for size in Thumbnailer.SIZES
+                                 for ext in thumbnailer.get_exts(f)]):
+                    yield (self.storage.path, f.path)
+
+    def cmd(self, args):
+        path = os.path.realpath(os.path.join(self.working_dir, args.path or ''))
+        if not os.path.exists(path):
+            print >>sys.stderr, 'Error: Path "%s" does not exist.' % path
+            return 1
+
+        if args.jobs > 1:
+            pool = Pool(args.jobs)
+            results = pool.imap_unordered(build_thumbnails, self.iter_paths(path))
+        else:
+            pool = None
+            results = (build_thumbnails(a) for a in self.iter_paths(path))
+
+        errors = 0
+        for error in results:
+            if error:
+                errors += 1
+                print >>sys.stderr, 'Error: %s' % error
+        if pool:
+            pool.close()
+            pool.join()
+        return 1 if errors else 0
 
 
 class Media(File):
@@ -99,6 +279,11 @@ class Media(File):
 
 class MediaListAction(ViewAction):
     IS_MEDIA = True
+    CACHE_RESPONSE = True
+    SCRIPTS = ['list.js']
+
+    def get_validators(self):
+        return self.get_file_validators()
 
     def get(self):
         dirs = []
@@ -129,12 +314,14 @@ class MediaListAction(ViewAction):
         self.ctx.template_vars['thumbs'] = thumbs
         self.ctx.template_vars['dirs'] = dirs
         self.ctx.template_vars['files'] = files
-        self.ctx.template_vars['scripts'].append('list.js')
         self.ctx.res.body = self.ctx.render('list.html')
 
 
 class GalleryPlugin(Plugin):
     def init(self):
+        self.register_cli_command('thumbnails', 'Manage the thumbnails of images')
+        self.register_cli_command('thumbnails', 'build', ThumbnailsBuildCmd)
+
         self.register_web_view(
             View(object_type='file', mimetype='image', name='thumbnail'),
             DownloadThumbnailAction, -1)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2011 Romain Bignon, Laurent Bachelier
+#
+# This file is part of assnet.
+#
+# assnet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# assnet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with assnet. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+from assnet.plugin import Plugin
+from assnet.cmd import Command
+from assnet.recent import RecentIndex
+
+
+__all__ = ['RecentPlugin']
+
+
+class IndexUpdateCmd(Command):
+    DESCRIPTION = 'Update the recent changes index used by feeds and blogs'
+
+    @staticmethod
+    def configure_parser(parser):
+        parser.add_argument('paths', nargs='*', metavar='PATH',
+                            help='Only rescan these files or directories')
+
+    def cmd(self, args):
+        index = RecentIndex(self.storage)
+        if args.paths and index.exists():
+            count = index.update(args.paths)
+        else:
+            count = index.rebuild()
+        print '%d entries indexed.' % count
+
+
+class RecentPlugin(Plugin):
+    def init(self):
+        self.register_cli_command('index', 'Manage the recent changes index')
+        self.register_cli_command('index', 'update', IndexUpdateCmd)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2011 Romain Bignon, Laurent Bachelier
+#
+# This file is part of assnet.
+#
+# assnet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# assnet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with assnet. If not, see <http://www.gnu.org/licenses/>.
+
+
+import sys
+
+from assnet.plugin import Plugin
+from assnet.cmd import Command
+from assnet.backends import BACKENDS
+
+
+__all__ = ['StoragePlugin']
+
+
+class MigrateCmd(Command):
+    DESCRIPTION = 'Move the stored objects to another backend'
+
+    @staticmethod
+    def configure_parser(parser):
+        parser.add_argument('backend', choices=sorted(BACKENDS.keys()))
+
+    def cmd(self, args):
+        config = self.storage.get_config()
+        current = config.data['storage'].get('backend', self.storage.DEFAULT_BACKEND)
+        if current == args.backend:
+            print >>sys.stderr, 'Error: the "%s" backend is already used.' % args.backend
+            return 1
+
+        source = self.storage.backend
+        dest = BACKENDS[args.backend](self.storage.path)
+        count = 0
+        with dest.transaction():
+            for name in self.storage.iter_object_names():
+                data = source.read(name)
+                if data is not None:
+                    dest.write(name, data)
+                    count += 1
+
+        # the old objects are kept, to be able to go back
+        config.data['storage']['backend'] = args.backend
+        config.save()
+        print 'Migrated %d objects from "%s" to "%s".' % (count, current, args.backend)
+
+
+class StoragePlugin(Plugin):
+    def init(self):
+        self.register_cli_command('storage', 'Manage the storage of objects')
+        self.register_cli_command('storage', 'migrate', MigrateCmd)
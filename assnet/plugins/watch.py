@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2011 Romain Bignon, Laurent Bachelier
+#
+# This file is part of assnet.
+#
+# assnet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# assnet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with assnet. If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+import select
+from time import time
+
+from assnet.plugin import Plugin
+from assnet.cmd import Command
+from assnet.recent import RecentIndex
+from assnet.inotify import Inotify, INOTIFY_SUPPORT, IN_MODIFY, IN_ATTRIB, \
+    IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE, \
+    IN_Q_OVERFLOW, IN_IGNORED, IN_ISDIR, IN_ONLYDIR, IN_DONT_FOLLOW, \
+    IN_EXCL_UNLINK
+from .gallery import Thumbnailer
+
+
+__all__ = ['WatchPlugin', 'Watcher']
+
+
+class Watcher(object):
+    """
+    Follow the changes of a working tree and of its storage with inotify.
+
+    Running processes learn about changes of the storage done behind their
+    back (i.e. a configuration edited by hand) through its generation file,
+    which is touched after each batch of events. Changes of the working tree
+    update the recent changes index, if there is one.
+    Thumbnails of deleted files are removed, and their configurations
+    too if prune is True.
+    """
+    MASK = IN_CREATE | IN_DELETE | IN_MODIFY | IN_CLOSE_WRITE | IN_ATTRIB \
+         | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+    # storage directories only written by assnet, as caches
+    IGNORED_DIRS = ('cache', 'thumbnails', 'assets_cache')
+    # wait for events to settle before acting
+    DELAY = 0.5
+    # but do not wait more than that under a continuous flow of events
+    MAX_DELAY = 5
+
+    def __init__(self, storage, prune=False):
+        self.storage = storage
+        self.root = storage.root
+        self.storage_path = os.path.realpath(storage.path)
+        self.prune = prune
+        self.thumbnailer = Thumbnailer(storage)
+        self.inotify = Inotify()
+        # watch descriptors to directories
+        self.dirs = {}
+        self._reset()
+        self.add_tree(self.root)
+        if not self.storage_path.startswith(self.root + '/'):
+            self.add_tree(self.storage_path)
+
+    def _reset(self):
+        self.changed = set()
+        # deleted paths to whether they were directories
+        self.deleted = {}
+        self.storage_changed = False
+        self.overflow = False
+
+    def is_storage(self, realpath):
+        return realpath == self.storage_path or realpath.startswith(self.storage_path + '/')
+
+    def add_tree(self, realpath):
+        for dirpath, dirnames, filenames in os.walk(realpath):
+            if dirpath == self.storage_path:
+                dirnames[:] = [d for d in dirnames if d not in self.IGNORED_DIRS]
+            try:
+                wd = self.inotify.add_watch(dirpath, self.MASK)
+            except OSError:
+                # removed meanwhile, or not readable
+                dirnames[:] = []
+                continue
+            self.dirs[wd] = dirpath
+
+    def remove_tree(self, realpath):
+        """
+        Stop watching a directory which was moved away,
+        as its watches still report the old paths.
+        """
+        prefix = realpath + '/'
+        for wd, dirpath in self.dirs.items():
+            if dirpath == realpath or dirpath.startswith(prefix):
+                del self.dirs[wd]
+                try:
+                    self.inotify.rm_watch(wd)
+                except OSError:
+                    pass
+
+    def handle(self, wd, mask, cookie, name):
+        if mask & IN_Q_OVERFLOW:
+            self.overflow = True
+            return
+        if mask & IN_IGNORED:
+            self.dirs.pop(wd, None)
+            return
+        dirpath = self.dirs.get(wd)
+        if dirpath is None:
+            return
+        realpath = os.path.join(dirpath, name) if name else dirpath
+        isdir = bool(mask & IN_ISDIR)
+
+        if self.is_storage(realpath):
+            if dirpath == self.storage_path:
+                if name == 'generation' or name.startswith('.generation'):
+                    # assnet touches it after writing objects, so running
+                    # processes already know about the previous changes
+                    if name == 'generation':
+                        self.storage_changed = False
+                    return
+                if name in self.IGNORED_DIRS:
+                    return
+                # locks taken by assnet
+                if name.startswith('.') and name.endswith('.lock'):
+                    return
+            if isdir and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_tree(realpath)
+            self.storage_changed = True
+            return
+
+        if isdir and mask & IN_MOVED_FROM:
+            self.remove_tree(realpath)
+        if isdir and mask & (IN_CREATE | IN_MOVED_TO):
+            self.add_tree(realpath)
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self.deleted[realpath] = isdir
+        self.changed.add(realpath)
+
+    def wait(self, timeout=None):
+        """
+        Wait for events and handle them.
+        Returns False if there were none before the timeout.
+        """
+        if not select.select([self.inotify], [], [], timeout)[0]:
+            return False
+        for event in self.inotify.read():
+            self.handle(*event)
+        return True
+
+    def get_path(self, realpath):
+        relpath = os.path.relpath(realpath, self.root)
+        if relpath in (os.curdir, os.pardir) or relpath.startswith(os.pardir + os.sep):
+            return None
+        return '/' + relpath
+
+    def prune_files(self, realpath, isdir):
+        """
+        Remove the thumbnails of a deleted file, and of the files it contained
+        if it was a directory. Configurations are only removed if pruning.
+        """
+        path = self.get_path(realpath)
+        if path is None:
+            return
+        paths = set([path])
+        if isdir:
+            prefix = path + '/'
+            for f in self.storage.iter_files():
+                if f.path is not None and f.path.startswith(prefix):
+                    paths.add(f.path)
+            # files without configuration can still have thumbnails
+            for entry in RecentIndex(self.storage).iter_entries(path):
+                paths.add(entry[0])
+        for path in sorted(paths):
+            f = self.storage.get_file(path)
+            if self.prune and f.exists:
+                f.remove()
+                print 'Removed the configuration of %s.' % path
+            if self.thumbnailer.remove(f):
+                print 'Removed the thumbnails of %s.' % path
+
+    def prune_missing(self):
+        """
+        Like prune_files, for all the missing files with a configuration.
+        Used when events were lost.
+        """
+        for f in self.storage.iter_files():
+            if f.path is not None and f.get_stat() is None:
+                self.prune_files(os.path.join(self.root, f.path[1:]), False)
+
+    def flush(self):
+        """
+        Act on the handled events.
+        """
+        index = RecentIndex(self.storage)
+        if self.overflow:
+            print >>sys.stderr, 'Warning: events were lost, checking everything.'
+            self.prune_missing()
+            self.storage.touch()
+            if index.exists():
+                index.rebuild()
+            self._reset()
+            return
+
+        for realpath, isdir in sorted(self.deleted.iteritems()):
+            # it could have been replaced (i.e. saved by an editor)
+            if not os.path.lexists(realpath):
+                self.prune_files(realpath, isdir)
+        if self.storage_changed:
+            self.storage.touch()
+        if self.changed and index.exists():
+            index.update(self.changed)
+        self._reset()
+
+    def run(self):
+        while True:
+            self.wait()
+            deadline = time() + self.MAX_DELAY
+            while time() < deadline and self.wait(self.DELAY):
+                pass
+            self.flush()
+
+    def close(self):
+        self.inotify.close()
+
+
+class WatchCmd(Command):
+    DESCRIPTION = 'Follow the changes of the working tree and of the storage'
+
+    @staticmethod
+    def configure_parser(parser):
+        parser.add_argument('--prune', action='store_true',
+                            help='Also remove the configurations (i.e. permissions) '
+                                 'of deleted files')
+
+    def cmd(self, args):
+        if not INOTIFY_SUPPORT:
+            print >>sys.stderr, 'Error: inotify is not supported on this system.'
+            return 1
+        watcher = Watcher(self.storage, prune=args.prune)
+        print 'Watching %d directories.' % len(watcher.dirs)
+        sys.stdout.flush()
+        try:
+            watcher.run()
+        finally:
+            watcher.close()
+
+
+class WatchPlugin(Plugin):
+    def init(self):
+        self.register_cli_command('watch', WatchCmd)
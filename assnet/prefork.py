@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2011 Romain Bignon, Laurent Bachelier
+#
+# This file is part of assnet.
+#
+# assnet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# assnet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with assnet. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+import os
+import sys
+import time
+import errno
+import signal
+import threading
+import traceback
+from tempfile import mkstemp
+
+from paste import httpserver
+
+from .zerocopy import WSGIHandler
+
+
+__all__ = ['PreforkServer']
+
+
+class WorkerWSGIServer(httpserver.WSGIServer):
+    """
+    Threaded WSGI server of a worker process.
+    It counts the requests it accepted.
+    """
+    # wake up regularly to check if the worker should stop
+    timeout = 1
+
+    def __init__(self, *args, **kwargs):
+        httpserver.WSGIServer.__init__(self, *args, **kwargs)
+        self.requests = 0
+
+    def get_request(self):
+        conn, info = httpserver.WSGIServer.get_request(self)
+        # the listening socket is non-blocking, the connections are not
+        conn.setblocking(1)
+        return (conn, info)
+
+    def process_request(self, request, client_address):
+        self.requests += 1
+        httpserver.WSGIServer.process_request(self, request, client_address)
+
+
+class PreforkServer(object):
+    """
+    Serve a WSGI application with several processes sharing the listening socket,
+    so requests can use more than one CPU.
+
+    The master process only supervises the workers: it replaces those which die
+    or stop responding, and all of them on SIGHUP (to empty their caches, for
+    instance after changing templates or assets). Code changes still require
+    a restart.
+    Workers exit after max_requests requests (if not 0), to bound their memory.
+    """
+    # seconds without a heartbeat before a worker is killed
+    TIMEOUT = 30
+
+    def __init__(self, application, host, port, workers, max_requests=0):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.nb_workers = workers
+        self.max_requests = max_requests
+        # pid: heartbeat file
+        self.workers = {}
+        # pids of the workers which are exiting
+        self.retired = set()
+        self.running = False
+        self.reloading = False
+
+    def serve(self):
+        # no threads are started here, so the workers can be forked safely
+        self.server = WorkerWSGIServer(self.application, (self.host, int(self.port)),
+                                       WSGIHandler, request_queue_size=128)
+        # all workers wait for connections, only one gets each of them
+        self.server.socket.setblocking(0)
+        print 'serving on http://%s:%s with %d workers' % (self.host, self.port, self.nb_workers)
+
+        self.running = True
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, self._reload)
+        try:
+            while self.running:
+                self.reap_workers()
+                if self.reloading:
+                    self.reloading = False
+                    # old workers finish their requests, new ones take the next
+                    self.retire_workers()
+                self.spawn_workers()
+                self.check_workers()
+                time.sleep(1)
+        finally:
+            self.retire_workers()
+            while self.retired:
+                self.reap_workers(block=True)
+            self.server.socket.close()
+
+    def _stop(self, signum, frame):
+        self.running = False
+
+    def _reload(self, signum, frame):
+        self.reloading = True
+
+    def spawn_workers(self):
+        while len(self.workers) < self.nb_workers:
+            fd, heartbeat = mkstemp(prefix='assnet-worker-')
+            os.close(fd)
+            pid = os.fork()
+            if pid == 0:
+                status = 0
+                try:
+                    self.run_worker(heartbeat)
+                except:
+                    traceback.print_exc()
+                    status = 1
+                finally:
+                    # os._exit() does not flush them
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                    os._exit(status)
+            self.workers[pid] = heartbeat
+
+    def reap_workers(self, block=False):
+        """
+        Forget about the workers which exited.
+        If block is True, wait for at least one of them.
+        """
+        while True:
+            try:
+                pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    # no workers left at all
+                    for heartbeat in self.workers.values():
+                        os.unlink(heartbeat)
+                    self.workers.clear()
+                    self.retired.clear()
+                    return
+                raise
+            if pid == 0:
+                return
+            if os.WIFSIGNALED(status):
+                print >>sys.stderr, 'Worker %d was killed by signal %d.' % (pid, os.WTERMSIG(status))
+            elif os.WEXITSTATUS(status):
+                print >>sys.stderr, 'Worker %d exited with status %d.' % (pid, os.WEXITSTATUS(status))
+            self.retired.discard(pid)
+            heartbeat = self.workers.pop(pid, None)
+            if heartbeat:
+                os.unlink(heartbeat)
+            if block:
+                return
+
+    def check_workers(self):
+        """
+        Kill the workers which stopped responding, they will be replaced.
+        """
+        now = time.time()
+        for pid, heartbeat in self.workers.items():
+            try:
+                if now - os.path.getmtime(heartbeat) > self.TIMEOUT:
+                    print >>sys.stderr, 'Worker %d timed out, killing it.' % pid
+                    os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def retire_workers(self):
+        """
+        Ask the current workers to exit after their current requests.
+        """
+        for pid, heartbeat in self.workers.items():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+            else:
+                self.retired.add(pid)
+            os.unlink(heartbeat)
+        self.workers.clear()
+
+    def run_worker(self, heartbeat):
+        server = self.server
+        server.running = True
+
+        def stop(signum, frame):
+            server.running = False
+        signal.signal(signal.SIGTERM, stop)
+        # handled by the master
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        while server.running and os.getppid() != 1 and \
+                (not self.max_requests or server.requests < self.max_requests):
+            os.utime(heartbeat, None)
+            server.handle_request()
+        server.socket.close()
+
+        # let the current requests finish
+        for thread in threading.enumerate():
+            if thread is not threading.current_thread():
+                thread.join()
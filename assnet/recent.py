@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2011 Romain Bignon, Laurent Bachelier
+#
+# This file is part of assnet.
+#
+# assnet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# assnet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with assnet. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import stat
+import json
+import heapq
+import posixpath
+import mimetypes
+from time import time
+from tempfile import NamedTemporaryFile
+
+from .cache import LRUCache
+from .files import iter_dir
+
+
+__all__ = ['RecentIndex']
+
+
+class RecentIndex(object):
+    """
+    Index of the files and directories of the working tree, newest first,
+    so views can find the last changes without walking the tree.
+    Entries are (path, mtime, size, mimetype, isdir) lists, paths being
+    like File.path. Symlinked directories and the storage are not indexed.
+
+    Entries are grouped by directory, with the mtime of the directory:
+    refresh() only lists again the directories which changed since.
+    Files written in place, without being replaced, are only seen
+    by "asn index update" or "asn watch".
+    """
+    VERSION = 2
+    # a directory changed this recently could still change within
+    # the same mtime, so it is listed again until it is older
+    RACY_DELAY = 1
+    # parsed indexes, until their file changes
+    INDEXES = LRUCache(10)
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.root = storage.root
+        self.storage_path = os.path.realpath(storage.path)
+        self.path = os.path.join(storage.path, 'cache', 'recent.json')
+
+    def get_stamp(self):
+        """
+        Identify the current state of the index, or None if it does not exist.
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    def exists(self):
+        return self.get_stamp() is not None
+
+    def get_dirs(self):
+        """
+        Get the indexed directories, as a dict of path: (mtime, entries),
+        entries being newest first. The mtime is None if it was too recent.
+        Returns None if the index does not exist or is unusable.
+        """
+        stamp = self.get_stamp()
+        if stamp is None:
+            return None
+        cached = self.INDEXES.get(self.path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        try:
+            with open(self.path, 'rb') as fp:
+                data = json.load(fp)
+        except (IOError, ValueError):
+            return None
+        if data.get('version') != self.VERSION:
+            return None
+        dirs = {}
+        for path, (mtime, entries) in data['dirs'].iteritems():
+            dirs[path.encode('utf-8')] = \
+                (mtime, [[entry[0].encode('utf-8')] + entry[1:] for entry in entries])
+        self.INDEXES.set(self.path, (stamp, dirs))
+        return dirs
+
+    def get_entries(self):
+        """
+        Get all the entries, newest first.
+        """
+        return list(self.iter_entries('/'))
+
+    def iter_entries(self, path='/'):
+        """
+        Get the entries below a directory, newest first.
+        """
+        dirs = self.get_dirs() or {}
+        lists = []
+        paths = [path.rstrip('/') or '/']
+        while paths:
+            record = dirs.get(paths.pop())
+            if record is None:
+                continue
+            lists.append(self._iter_sortable(record[1]))
+            paths.extend([entry[0] for entry in record[1] if entry[4]])
+        for key, entry in heapq.merge(*lists):
+            yield entry
+
+    @staticmethod
+    def _iter_sortable(entries):
+        for entry in entries:
+            yield ((-entry[1], entry[0]), entry)
+
+    def save(self, dirs):
+        dirname = os.path.dirname(self.path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with NamedTemporaryFile(dir=dirname, prefix='.recent', delete=False) as fp:
+            json.dump({'version': self.VERSION, 'dirs': dirs}, fp)
+        os.rename(fp.name, self.path)
+        self.INDEXES.set(self.path, (self.get_stamp(), dirs))
+        return sum([len(record[1]) for record in dirs.itervalues()])
+
+    def _list(self, path):
+        """
+        List the entries of a directory.
+        Returns (mtime, entries, subdirectories), or None if it is gone.
+        """
+        realpath = os.path.join(self.root, path[1:])
+        try:
+            # before listing, so changes made meanwhile are seen next time
+            mtime = os.stat(realpath).st_mtime
+            children = list(iter_dir(realpath))
+        except OSError:
+            return None
+        if time() - mtime < self.RACY_DELAY:
+            mtime = None
+        entries = []
+        subdirs = []
+        for name, st, is_symlink in children:
+            childpath = posixpath.join(path, name)
+            if st is None or os.path.join(realpath, name) == self.storage_path:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                if not is_symlink:
+                    entries.append([childpath, st.st_mtime, None, 'directory', True])
+                    subdirs.append(childpath)
+            else:
+                entries.append([childpath, st.st_mtime, st.st_size,
+                                mimetypes.guess_type(name)[0], False])
+        entries.sort(key=lambda entry: (-entry[1], entry[0]))
+        return (mtime, entries, subdirs)
+
+    def _forget(self, path, dirs):
+        prefix = path.rstrip('/') + '/'
+        for name in [name for name in dirs if name == path or name.startswith(prefix)]:
+            del dirs[name]
+
+    def _scan(self, path, dirs):
+        """
+        Index a directory and its subdirectories.
+        """
+        self._forget(path, dirs)
+        paths = [path]
+        while paths:
+            path = paths.pop()
+            listing = self._list(path)
+            if listing is not None:
+                dirs[path] = (listing[0], listing[1])
+                paths.extend(listing[2])
+
+    def _rescan(self, path, dirs):
+        """
+        List again an indexed directory, scanning its new subdirectories.
+        """
+        listing = self._list(path)
+        if listing is None:
+            self._forget(path, dirs)
+        else:
+            mtime, entries, subdirs = listing
+            previous = dirs.get(path, (None, []))[1]
+            dirs[path] = (mtime, entries)
+            for subdir in subdirs:
+                if subdir not in dirs:
+                    self._scan(subdir, dirs)
+            subdirs = set(subdirs)
+            for entry in previous:
+                if entry[4] and entry[0] not in subdirs:
+                    self._forget(entry[0], dirs)
+        # the entry of the directory in its parent
+        if path != '/':
+            parent = posixpath.dirname(path)
+            if parent in dirs:
+                self._rescan_entry(parent, path, dirs)
+
+    def _rescan_entry(self, parent, path, dirs):
+        mtime, entries = dirs[parent]
+        entries = [entry for entry in entries if entry[0] != path]
+        if path in dirs:
+            try:
+                st = os.stat(os.path.join(self.root, path[1:]))
+            except OSError:
+                pass
+            else:
+                entries.append([path, st.st_mtime, None, 'directory', True])
+                entries.sort(key=lambda entry: (-entry[1], entry[0]))
+        dirs[parent] = (mtime, entries)
+
+    def refresh(self):
+        """
+        List again the directories which changed since the last update.
+        Returns False if the index can not be used, i.e. it does not
+        exist or it is outdated and can not be written.
+        """
+        dirs = self.get_dirs()
+        if dirs is None:
+            return False
+        changed = []
+        for path, (mtime, entries) in dirs.iteritems():
+            try:
+                if mtime is None or os.stat(os.path.join(self.root, path[1:])).st_mtime != mtime:
+                    changed.append(path)
+            except OSError:
+                changed.append(path)
+        if not changed:
+            return True
+        newdirs = dict(dirs)
+        # parents first, as they can forget their children
+        for path in sorted(changed):
+            if path in newdirs:
+                self._rescan(path, newdirs)
+        if newdirs == dirs:
+            return True
+        try:
+            self.save(newdirs)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def rebuild(self):
+        """
+        Index the whole tree.
+        Returns the number of entries.
+        """
+        dirs = {}
+        self._scan('/', dirs)
+        return self.save(dirs)
+
+    def update(self, realpaths):
+        """
+        Only rescan some files or directories, i.e. the ones a watcher
+        was told about. Directories are rescanned entirely.
+        Returns the number of entries.
+        """
+        dirs = self.get_dirs()
+        if dirs is None:
+            return self.rebuild()
+        dirs = dict(dirs)
+        for realpath in realpaths:
+            path = self.get_path(realpath)
+            if path is None:
+                continue
+            known = path in dirs
+            # adding or removing an entry changes its directory
+            parent = path
+            while parent != '/':
+                parent = posixpath.dirname(parent)
+                if parent in dirs:
+                    self._rescan(parent, dirs)
+                    break
+            if known and path in dirs:
+                self._scan(path, dirs)
+                if path != '/' and posixpath.dirname(path) in dirs:
+                    self._rescan_entry(posixpath.dirname(path), path, dirs)
+        return self.save(dirs)
+
+    def get_path(self, realpath):
+        """
+        Get the path of a file of the working tree, or None if it is
+        outside of it or in the storage.
+        """
+        realpath = os.path.realpath(realpath)
+        if realpath == self.storage_path or realpath.startswith(self.storage_path + os.sep):
+            return None
+        relpath = os.path.relpath(realpath, self.root)
+        if relpath == os.curdir:
+            return '/'
+        if relpath == os.pardir or relpath.startswith(os.pardir + os.sep):
+            return None
+        return '/' + relpath
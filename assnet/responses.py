@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2011 Romain Bignon, Laurent Bachelier
+#
+# This file is part of assnet.
+#
+# assnet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# assnet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with assnet. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+import os
+import errno
+import hashlib
+from tempfile import NamedTemporaryFile
+
+from .cache import LRUCache
+
+
+__all__ = ['IResponseCache', 'MemoryResponseCache', 'DiskResponseCache', 'RESPONSE_CACHES']
+
+
+class IResponseCache(object):
+    """
+    Keep rendered responses, as (state, content_type, body) tuples.
+    The state tells which version of the data was rendered, and
+    entries are only used if it did not change since.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def hash_key(self, key):
+        return hashlib.sha1(repr((self.storage.path, key))).hexdigest()
+
+    def get(self, key, state):
+        """
+        key: tuple identifying the response
+        Returns the (content_type, body) tuple, or None if missing or outdated.
+        """
+        raise NotImplementedError()
+
+    def set(self, key, state, content_type, body):
+        raise NotImplementedError()
+
+
+class MemoryResponseCache(IResponseCache):
+    # shared by all the requests of the process
+    RESPONSES = LRUCache(200)
+
+    def get(self, key, state):
+        entry = self.RESPONSES.get(self.hash_key(key))
+        if entry is not None and entry[0] == state:
+            return entry[1:]
+
+    def set(self, key, state, content_type, body):
+        self.RESPONSES.set(self.hash_key(key), (state, content_type, body))
+
+
+class DiskResponseCache(IResponseCache):
+    """
+    Stored in .assnet/cache/responses, shared by all processes.
+    """
+
+    def __init__(self, storage):
+        IResponseCache.__init__(self, storage)
+        self.path = os.path.join(storage.path, 'cache', 'responses')
+
+    def get(self, key, state):
+        try:
+            with open(os.path.join(self.path, self.hash_key(key)), 'rb') as fp:
+                if fp.readline().rstrip('\n') != state:
+                    return None
+                content_type = fp.readline().rstrip('\n')
+                return (content_type, fp.read())
+        except IOError:
+            return None
+
+    def set(self, key, state, content_type, body):
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError, e:
+                # another process could have created it
+                if e.errno != errno.EEXIST:
+                    raise
+        # write then rename, so readers never see a partial entry
+        with NamedTemporaryFile(dir=self.path, delete=False) as fp:
+            fp.write('%s\n%s\n' % (state, content_type))
+            fp.write(body)
+        os.rename(fp.name, os.path.join(self.path, self.hash_key(key)))
+
+
+RESPONSE_CACHES = {'memory': MemoryResponseCache, 'disk': DiskResponseCache}
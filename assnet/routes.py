@@ -18,6 +18,9 @@
 # along with assnet. If not, see <http://www.gnu.org/licenses/>.
 
 
+from .cache import LRUCache
+
+
 __all__ = ['View', 'Router']
 
 
@@ -90,6 +93,11 @@ class Router(object):
     def __init__(self):
         self.actions = {}
         self.views = {}
+        self.sorted_views = []
+        # (object_type, mimetype): (views by priority, views by name)
+        self.table = None
+        # (view, realpath, mtime): result of check_file()
+        self.checks = LRUCache(1000)
 
     def register_action(self, name, action):
         """
@@ -110,6 +118,51 @@ class Router(object):
         if priority is None:
             priority = view.guess_priority()
         self.views.setdefault(priority, []).append((view, action))
+        self.table = None
+
+    def compile(self):
+        """
+        Sort the registered views once, after the plugins are loaded.
+        The views matching each (object_type, mimetype) are then looked up
+        in a table, filled on first use.
+        """
+        views = []
+        for priority in sorted(self.views.keys(), reverse=True):
+            views.extend(self.views[priority])
+        self.sorted_views = views
+        self.table = {}
+
+    def get_views(self, object_type, mimetype):
+        """
+        Get the (view, action) tuples matching the object type and mimetype,
+        by priority and by name.
+        """
+        if self.table is None:
+            self.compile()
+        key = (object_type, mimetype)
+        views = self.table.get(key)
+        if views is None:
+            by_priority = [(view, action) for view, action in self.sorted_views
+                           if view.match(object_type, mimetype)]
+            by_name = sorted(by_priority, key=lambda (view, action): str(view))
+            views = self.table[key] = (by_priority, by_name)
+        return views
+
+    def check_file(self, view, f):
+        """
+        Cached View.check_file(), valid as long as the file is not modified.
+        """
+        if type(view).check_file == View.check_file:
+            return True
+        st = f.get_stat()
+        if st is None:
+            return view.check_file(f)
+        key = (id(view), f.get_realpath(), st.st_mtime)
+        result = self.checks.get(key)
+        if result is None:
+            result = view.check_file(f)
+            self.checks.set(key, result)
+        return result
 
     def find_action(self, name):
         """
@@ -131,26 +184,19 @@ class Router(object):
         # use the default file view if no view was requested
         if name is None:
             name = f.view
-        object_type = f.get_object_type()
-        mimetype = f.get_mimetype()
-
-        for priority in sorted(self.views.keys(), reverse=True):
-            for view, action in self.views[priority]:
-                if view.match(object_type, mimetype) and view.check_file(f):
-                    # if no view was requested, or if we found the requested view
-                    if name is None or view.name == name:
-                        return (view, action)
+        by_priority, by_name = self.get_views(f.get_object_type(), f.get_mimetype())
+        for view, action in by_priority:
+            # if no view was requested, or if we found the requested view
+            if (name is None or view.name == name) and self.check_file(view, f):
+                return (view, action)
         return (None, None)
 
     def get_available_views(self, f):
         """
         f: File
-        Get all the available views for a file.
+        Get all the available views for a file, sorted by name.
         """
-        object_type = f.get_object_type()
-        mimetype = f.get_mimetype()
-
-        for views in self.views.itervalues():
-            for view, action in views:
-                if view.match(object_type, mimetype) and view.check_file(f):
-                    yield view
+        by_priority, by_name = self.get_views(f.get_object_type(), f.get_mimetype())
+        for view, action in by_name:
+            if self.check_file(view, f):
+                yield view
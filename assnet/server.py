@@ -18,36 +18,60 @@
 # along with assnet. If not, see <http://www.gnu.org/licenses/>.
 
 
+import os
 import posixpath
+import calendar
 import re
-import os
 from paste import httpserver
-from paste.auth.cookie import AuthCookieSigner
-from paste.fileapp import FileApp as PasteFileApp
+from paste.auth.cookie import AuthCookieSigner, make_time
+from paste.fileapp import FileApp as PasteFileApp, DataApp, BLOCK_SIZE, _FileIter
 from webob import Request, Response
 from webob.exc import HTTPError, HTTPFound, HTTPNotFound, HTTPForbidden, \
         HTTPMethodNotAllowed, HTTPInternalServerError
 from paste.url import URL
 from paste.auth.basic import AuthBasicAuthenticator
-from paste.httpheaders import REMOTE_USER, AUTH_TYPE
+from paste.httpheaders import REMOTE_USER, AUTH_TYPE, CACHE_CONTROL
 from datetime import timedelta
 import urlparse
+import urllib
 import json
+import time
+import base64
+import hashlib
+from functools import partial
 
 from .butt import Butt
 from .storage import Storage
-from .template import build_lookup, build_vars
+from .template import build_lookup, build_vars, build_asset_url, get_data
+from .data import AssetBundles
 from .users import Anonymous
+from .files import get_fingerprint
+from .recent import RecentIndex
 from .routes import Router
 from .filters import quote_url, quote_path
 from .security import new_secret
+from .responses import RESPONSE_CACHES
+from .cache import LRUCache
+from .version import VERSION
+from .prefork import PreforkServer
+from .asyncserver import AsyncServer
+from .zerocopy import WSGIHandler, fadvise_sequential
 
 
 __all__ = ['ViewAction', 'Action', 'Server', 'FileApp']
 
 
+# header used to let the front-end server send files, by SERVER_SENDFILE value
+SENDFILE_HEADERS = {'apache': 'X-Sendfile',
+                    'lighttpd': 'X-LIGHTTPD-send-file',
+                    'nginx': 'X-Accel-Redirect'}
+
+
 class Context(object):
     SANITIZE_REGEXP = re.compile(r'/[%s+r]+/|\\+|/+' % re.escape(r'/.'))
+    # assets of every page, views can add theirs
+    STYLESHEETS = ['main.css', 'user.css']
+    SCRIPTS = ['mootools-core-1.3.1.js', 'mootools-more-1.3.1.1.js', 'main.js']
 
     def __init__(self, butt, environ, start_response):
         self.router = butt.router
@@ -70,6 +94,7 @@ class Context(object):
                 environ['SCRIPT_NAME'] = script_path
         self.res = Response()
         self.user = Anonymous()
+        self.response_cache = None
 
         self._init_default_response()
 
@@ -80,13 +105,17 @@ class Context(object):
         self._init_default_config()
         self._init_session()
 
-    def _init_paths(self):
-        path = self.req.path_info
+    @classmethod
+    def normalize_path(cls, path):
         # remove the trailing "/" server-side, and other nice stuff
-        path = self.SANITIZE_REGEXP.sub('/', path)
+        path = cls.SANITIZE_REGEXP.sub('/', path)
         path = posixpath.normpath(path)
         if path in ('.', '/'):
             path = ''
+        return path
+
+    def _init_paths(self):
+        path = self.normalize_path(self.req.path_info)
 
         if self.storage:
             f = self.storage.get_file(path)
@@ -111,6 +140,16 @@ class Context(object):
         if not self.storage:
             return
         config = self.storage.get_config()
+        cache_name = config.data["web"].get("response_cache", "memory")
+        if cache_name in RESPONSE_CACHES:
+            self.response_cache = RESPONSE_CACHES[cache_name](self.storage)
+        sendfile_header = config.data["web"].get("sendfile_header") \
+            or SENDFILE_HEADERS.get(self._environ.get("SERVER_SENDFILE"))
+        if sendfile_header:
+            # read by FileApp
+            prefix = config.data["web"].get("sendfile_prefix", "/sendfile")
+            self._environ['assnet.sendfile'] = (str(sendfile_header), prefix.encode('utf-8'),
+                                                self.storage.root)
         self.cookie_secret = config.data["web"].get("cookie_secret")
         try:
             if self.cookie_secret is None:
@@ -141,8 +180,10 @@ class Context(object):
             'path': self.path,
             'url': self.url,
             'root_url': self.root_url,
-            'stylesheets': ['main.css', 'user.css'],
-            'scripts': ['mootools-core-1.3.1.js', 'mootools-more-1.3.1.1.js', 'main.js'],
+            'asset_url': partial(build_asset_url, self.root_url, get_data(self.storage)),
+            'asset_bundle': AssetBundles(self.storage).get_names if self.storage else list,
+            'stylesheets': list(self.STYLESHEETS),
+            'scripts': list(self.SCRIPTS),
         })
 
     def render(self, template):
@@ -160,18 +201,57 @@ class Context(object):
     def iter_files_recursively(self):
         if self.object_type != "directory":
             return
-        for root, directories, files in os.walk(self.file.get_realpath()):
-            path = root[len(self.storage.root):]
-            f = self.storage.get_file(path)
+        for f in self._walk(self.file):
+            yield f
 
-            if not self.user.has_perms(f, f.PERM_LIST):
+    def iter_recent_files(self, index):
+        """
+        Like iter_files_recursively, but newest first, from a RecentIndex.
+        Files removed since the last update of the index are skipped.
+        """
+        if self.object_type != "directory":
+            return
+        # permissions of the parent directories
+        listable = {}
+        for entry in index.iter_entries(self.file.path):
+            f = self.storage.get_file(entry[0])
+            if f.get_stat() is None:
                 continue
-
-            yield f
-            for filename in files:
-                f = self.storage.get_file(os.path.join(path, filename))
-                if self.user.has_perms(f, f.PERM_IN):
+            if f.isdir():
+                if self.user.has_perms(f, f.PERM_LIST):
                     yield f
+                continue
+            parent = posixpath.dirname(f.path).rstrip('/')
+            if parent not in listable:
+                d = self.storage.get_file(parent)
+                listable[parent] = self.user.has_perms(d, d.PERM_LIST)
+            if listable[parent] and self.user.has_perms(f, f.PERM_IN):
+                yield f
+
+    def _walk(self, d):
+        """
+        Like os.walk, yield a directory then its files,
+        and then walk its subdirectories, without following symlinks.
+        """
+        try:
+            children = list(d.iter_children())
+        except OSError:
+            children = []
+        listable = self.user.has_perms(d, d.PERM_LIST)
+        if listable:
+            yield d
+
+        subdirs = []
+        for f in children:
+            if f.isdir():
+                if not f.islink():
+                    subdirs.append(f)
+            elif listable and self.user.has_perms(f, f.PERM_IN):
+                yield f
+
+        for subdir in subdirs:
+            for f in self._walk(subdir):
+                yield f
 
     def login(self, user, set_cookie=True):
         """
@@ -234,6 +314,27 @@ class Context(object):
         self.session = session
 
 
+class AuthzContext(Context):
+    """
+    Context only able to authenticate the user and check permissions,
+    without templates nor session.
+    """
+
+    def __init__(self, storage, environ):
+        self.router = None
+        self.storage = storage
+        self._environ = environ
+        self._start_response = None
+        self.req = Request(environ)
+        self.req.charset = 'utf8'
+        self.res = Response()
+        self.user = Anonymous()
+        self.session = {}
+        self._init_paths()
+        # do not create it, there is no cookie to check without it
+        self.cookie_secret = storage.get_config().data["web"].get("cookie_secret")
+
+
 class Action(object):
     """
     REST action.
@@ -262,10 +363,68 @@ class Action(object):
                     method = None
                 else:
                     method = param_method
+        if method in ('GET', 'HEAD'):
+            return self._answer_conditional(getattr(self, method.lower()))
         if method in self.METHODS:
             return getattr(self, method.lower(), self._unhandled_method)()
         return self._unhandled_method()
 
+    def get_validators(self):
+        """
+        Get the validators of the GET response, as an (etag, last_modified) tuple.
+        If the client already has this version, it gets a 304 Not Modified
+        without the GET being run.
+        Returns None if the response can not be validated (the default).
+        """
+        return None
+
+    def get_cache_key(self):
+        """
+        Get a tuple identifying the GET response in the response cache;
+        it is only used while the validators do not change.
+        Returns None if the response should not be cached (the default).
+        """
+        return None
+
+    def _answer_conditional(self, method):
+        validators = self.get_validators()
+        if validators is None:
+            return method()
+        etag, last_modified = validators
+        req = self.ctx.req
+        # If-Modified-Since can not tell users apart, only use it alone
+        if req.if_none_match:
+            not_modified = etag in req.if_none_match
+        else:
+            not_modified = req.if_modified_since is not None and \
+                int(last_modified) <= calendar.timegm(req.if_modified_since.utctimetuple())
+
+        res = self.ctx.res
+        cache = self.ctx.response_cache
+        cache_key = self.get_cache_key() if cache and not not_modified else None
+        cached = cache.get(cache_key, etag) if cache_key else None
+        if not_modified:
+            # keep the headers and cookies set so far
+            res.status = 304
+            res.body = ''
+            del res.content_type
+        elif cached:
+            res.headers['Content-Type'], res.body = cached
+        else:
+            method()
+            if self.ctx.res is not res or res.status_int != 200:
+                return
+            if cache_key:
+                try:
+                    cache.set(cache_key, etag, res.headers['Content-Type'], res.body)
+                except (IOError, OSError):
+                    # the cache is only an optimization
+                    pass
+        res.etag = etag
+        res.last_modified = int(last_modified)
+        # the browser must ask every time, so it can not miss a change
+        res.cache_control.no_cache = True
+
     def head(self):
         return self.get()
 
@@ -286,7 +445,102 @@ class Action(object):
 
 
 class ViewAction(Action):
-    pass
+    # keep rendered responses in the response cache
+    CACHE_RESPONSE = False
+    # assets to add to the page
+    STYLESHEETS = []
+    SCRIPTS = []
+
+    def __init__(self, ctx):
+        Action.__init__(self, ctx)
+        ctx.template_vars['stylesheets'].extend(self.STYLESHEETS)
+        ctx.template_vars['scripts'].extend(self.SCRIPTS)
+
+    def get_user_identity(self):
+        """
+        Identify the user, for responses depending on him.
+        Views which only depend on permissions can use get_perms_fingerprint(),
+        so users with the same permissions share their responses; pages
+        telling who is logged in, or with the key of the user in their links,
+        can not.
+        """
+        return self.ctx.user.name if self.ctx.user.exists else None
+
+    def get_perms_fingerprint(self):
+        """
+        Identify what the permissions of the user depend on: his groups,
+        and his name if some file has permissions for him. It is only valid
+        with the generation, which is part of the validators.
+        """
+        user = self.ctx.user
+        if not user.exists:
+            return None
+        name = user.name if user.name in self.ctx.storage.get_users_with_perms() else None
+        return (name, tuple(user.groups))
+
+    def get_file_validators(self, recursive=False):
+        """
+        Get validators depending on the current file (and on the entries
+        of a directory, or its whole tree if recursive), on the stored objects
+        and on the user identity.
+        """
+        ctx = self.ctx
+        digest, mtime = get_fingerprint(ctx.file.get_realpath(), recursive,
+                                        exclude=os.path.realpath(ctx.storage.path))
+        generation = ctx.storage.get_generation()
+        if generation is not None:
+            mtime = max(mtime, generation[1])
+        etag = hashlib.sha1(repr((digest, generation, self._get_identity(),
+                                  self.get_assets_state(), VERSION))).hexdigest()
+        return (etag, mtime)
+
+    def get_assets_state(self):
+        """
+        Identify the assets the page links to, as their URLs change with them.
+        """
+        ctx = self.ctx
+        bundles = AssetBundles(ctx.storage)
+        names = ctx.template_vars['stylesheets'] + ctx.template_vars['scripts']
+        return (bundles.get_names(ctx.template_vars['stylesheets']),
+                bundles.get_names(ctx.template_vars['scripts']),
+                [ctx.storage.data.get_asset_hash(name) for name in names])
+
+    def get_recent_index(self):
+        """
+        Get the RecentIndex of the storage, with the changed directories
+        listed again, or None if it was never built or can not be refreshed.
+        """
+        index = RecentIndex(self.ctx.storage)
+        if index.refresh():
+            return index
+
+    def get_index_validators(self, index):
+        """
+        Like get_file_validators(recursive=True), but depending on the
+        recent changes index instead of the whole tree.
+        """
+        stamp = index.get_stamp()
+        if stamp is None:
+            return self.get_file_validators(recursive=True)
+        mtime = stamp[0]
+        generation = self.ctx.storage.get_generation()
+        if generation is not None:
+            mtime = max(mtime, generation[1])
+        etag = hashlib.sha1(repr((self.ctx.path, stamp, generation, self._get_identity(),
+                                  self.get_assets_state(), VERSION))).hexdigest()
+        return (etag, mtime)
+
+    def get_cache_key(self):
+        if not self.CACHE_RESPONSE:
+            return None
+        # rendered links can depend on any parameter
+        params = sorted(self.ctx.req.GET.items())
+        return (self.ctx.path, self.__class__.__name__, params, self._get_identity())
+
+    def _get_identity(self):
+        if not hasattr(self, '_identity'):
+            self._identity = self.get_user_identity()
+        return self._identity
 
 
 class WSGIMethodException(Exception):
@@ -302,6 +556,11 @@ class WSGIMethodException(Exception):
 
 
 class Dispatcher(object):
+    # verified credentials, (root, generation, kind, digest): (username, user mtime)
+    CREDENTIALS = LRUCache(1000, ttl=300)
+    # credentials are not kept in memory as they are
+    CREDENTIALS_SALT = os.urandom(16)
+
     def __init__(self, ctx):
         self.ctx = ctx
         self.basic_auther = AuthBasicAuthenticator(
@@ -314,14 +573,66 @@ class Dispatcher(object):
         Allows to login by username/password, or if the username is _key,
         allows to login by key.
         """
+        secret = u'%s\0%s' % (username, password)
+        name = self.get_verified('basic', secret)
+        if name is not None:
+            if username == '_key':
+                environ['key_username'] = name
+            return True
         if username == '_key':
-            for user in self.ctx.storage.iter_users():
-                if password == user.key:
-                    # hack to pass the real username
-                    environ['key_username'] = user.name
-                    return True
+            user = self.ctx.storage.get_user_by_key(password)
+            if user:
+                # hack to pass the real username
+                environ['key_username'] = user.name
+                self.set_verified('basic', secret, user.name)
+                return True
         user = self.ctx.storage.get_user(username)
-        return user and user.is_valid_password(password)
+        if user and user.is_valid_password(password):
+            self.set_verified('basic', secret, user.name)
+            return True
+        return False
+
+    def _get_credentials_key(self, kind, secret):
+        if isinstance(secret, unicode):
+            secret = secret.encode('utf-8')
+        # any write changes the generation; it is read once, before
+        # verifying anything, so results are never newer than their key
+        if not hasattr(self, '_generation'):
+            self._generation = self.ctx.storage.get_generation()
+        return (self.ctx.storage.path, self._generation, kind,
+                hashlib.sha256(self.CREDENTIALS_SALT + secret).digest())
+
+    def _get_user_mtime(self, username):
+        # covers the storages without generation
+        return self.ctx.storage._get_mtime(os.path.join('users', username))
+
+    def get_verified(self, kind, secret):
+        """
+        Get the name of the user for which these credentials were verified,
+        unless the user was modified since. Returns None if unknown.
+        """
+        cached = self.CREDENTIALS.get(self._get_credentials_key(kind, secret))
+        if cached is not None and cached[1] == self._get_user_mtime(cached[0]):
+            return cached[0]
+
+    def set_verified(self, kind, secret, username, ttl=None):
+        """
+        Remember verified credentials, for at most ttl seconds if they expire.
+        """
+        self.CREDENTIALS.set(self._get_credentials_key(kind, secret),
+                             (username, self._get_user_mtime(username)), ttl)
+
+    @staticmethod
+    def get_cookie_expires(cookie):
+        """
+        Get when a cookie signed by AuthCookieSigner expires, as a timestamp.
+        It is only valid if the cookie is.
+        """
+        data = base64.decodestring(cookie.replace('_', '/').replace('~', '='))
+        # after the signature, written by make_time()
+        start = hashlib.sha1().digest_size
+        expires = data[start:start + len(make_time(0))]
+        return calendar.timegm(time.strptime(expires, '%Y%m%d%H%M'))
 
     def _authenticate(self):
         ctx = self.ctx
@@ -333,7 +644,7 @@ class Dispatcher(object):
             username = REMOTE_USER(ctx.req.environ)
             if not username:
                 username = self.basic_auther(ctx.req.environ)
-                if isinstance(username, str):
+                if isinstance(username, basestring):
                     if username == '_key':
                         username = ctx.req.environ['key_username']
                     AUTH_TYPE.update(ctx.req.environ, 'basic')
@@ -342,20 +653,45 @@ class Dispatcher(object):
                 else:
                     raise WSGIMethodException(username.wsgi_application)
         if authkey:
-            for user in ctx.storage.iter_users():
-                if authkey == user.key:
-                    # set the cookie for the following requests
-                    valid_user = user
-        elif cookie:
-            signer = AuthCookieSigner(secret=ctx.cookie_secret)
-            username = signer.auth(cookie)
+            user = ctx.storage.get_user_by_key(authkey)
+            if user:
+                # set the cookie for the following requests
+                valid_user = user
+        elif cookie and ctx.cookie_secret:
+            secret = '%s\0%s' % (ctx.cookie_secret, cookie)
+            username = self.get_verified('cookie', secret)
+            if username is None:
+                signer = AuthCookieSigner(secret=ctx.cookie_secret)
+                username = signer.auth(cookie)
+                if username:
+                    username = username.decode('utf-8')
+                    self.set_verified('cookie', secret, username,
+                                      self.get_cookie_expires(cookie) - time.time())
             if username:
-                username = username.decode('utf-8')
                 valid_user = ctx.storage.get_user(username)
         if valid_user:
             has_cookies = cookie and 'assnet_session' in ctx.req.cookies
             ctx.login(valid_user, set_cookie=not has_cookies)
 
+    def check_perms(self):
+        """
+        Raise HTTPForbidden or HTTPNotFound if the user can not access
+        the requested file or directory.
+        """
+        ctx = self.ctx
+        f = ctx.file
+        if ctx.object_type == 'directory':
+            if not ctx.user.has_perms(f, f.PERM_LIST):
+                if ctx.user.has_perms(f, f.PERM_IN):
+                    raise HTTPForbidden()
+                else:
+                    raise HTTPNotFound('File not found')
+        elif not ctx.user.has_perms(f, f.PERM_READ):
+            if ctx.user.has_perms(f, f.PERM_IN):
+                raise HTTPForbidden()
+            else:
+                raise HTTPNotFound('File not found')
+
     def dispatch(self):
         ctx = self.ctx
         router = ctx.router
@@ -380,19 +716,7 @@ class Dispatcher(object):
             if action is not None:
                 return action(ctx).answer()
 
-        # check perms
-        f = ctx.file
-        if ctx.object_type == 'directory':
-            if not ctx.user.has_perms(f, f.PERM_LIST):
-                if ctx.user.has_perms(f, f.PERM_IN):
-                    raise HTTPForbidden()
-                else:
-                    raise HTTPNotFound('File not found')
-        elif not ctx.user.has_perms(f, f.PERM_READ):
-            if ctx.user.has_perms(f, f.PERM_IN):
-                raise HTTPForbidden()
-            else:
-                raise HTTPNotFound('File not found')
+        self.check_perms()
 
         # normalize paths
         if ctx.object_type:
@@ -416,19 +740,104 @@ class Dispatcher(object):
             raise HTTPNotFound('File not found')
 
         # find the action to forward the request to
+        f = ctx.file
         view, action = router.find_view(f, ctx.req.GET.get('view'))
         if view and action:
             # find out current action/view and available views
             ctx.template_vars['view'] = view.name
-            ctx.template_vars['available_views'] = \
-                sorted(router.get_available_views(f), key=str)
+            ctx.template_vars['available_views'] = list(router.get_available_views(f))
             return action(ctx).answer()
 
         # action/view not found
         raise HTTPNotFound('No route found')
 
 
+class AuthzApp(object):
+    """
+    Check the permissions of the original request for a front-end server
+    (nginx's auth_request, lighttpd's mod_magnet): answer 204 if the user
+    can read the file, 403 otherwise.
+
+    The original request is given by the X-Original-URI header,
+    or by the path parameter (relative to the root).
+    Results are cached, until the storage changes or for TTL seconds
+    (cookies expire).
+    """
+    TTL = 60
+    RESULTS = LRUCache(10000)
+    CREDENTIALS = ('HTTP_AUTHORIZATION', 'REMOTE_USER', 'HTTP_COOKIE')
+
+    def __call__(self, environ, start_response):
+        storage = Storage.lookup(environ.get("ASSNET_ROOT"))
+        if not storage:
+            return HTTPInternalServerError()(environ, start_response)
+        environ = self.get_original_environ(environ)
+        if self.climbs(environ['PATH_INFO']):
+            # the front-end server resolves them, normalize_path() drops them
+            start_response('403 Forbidden', [('Cache-Control', 'private')])
+            return ['']
+        key = self.get_cache_key(storage, environ)
+        status = self.RESULTS.get(key)
+        if status is None:
+            try:
+                ctx = AuthzContext(storage, environ)
+                dispatcher = Dispatcher(ctx)
+                dispatcher._authenticate()
+                dispatcher.check_perms()
+                status = '204 No Content'
+            except (HTTPForbidden, HTTPNotFound):
+                # do not tell hidden files apart
+                status = '403 Forbidden'
+            self.RESULTS.set(key, status)
+        start_response(status, [('Cache-Control', 'private')])
+        return ['']
+
+    def get_original_environ(self, environ):
+        """
+        Build the environ of the original request.
+        """
+        environ = dict(environ)
+        if 'FORCE_SCRIPT_NAME' in environ:
+            environ['SCRIPT_NAME'] = environ.pop('FORCE_SCRIPT_NAME')
+        uri = environ.get('HTTP_X_ORIGINAL_URI')
+        if uri:
+            path, sep, environ['QUERY_STRING'] = uri.partition('?')
+            path = urllib.unquote(path)
+            script_name = environ.get('SCRIPT_NAME', '').rstrip('/')
+            if path.startswith(script_name + '/'):
+                path = path[len(script_name):]
+        else:
+            # authkey and authby are taken from the same query string
+            path = '/' + urlparse.parse_qs(environ.get('QUERY_STRING', '')) \
+                .get('path', [''])[0].lstrip('/')
+        environ['PATH_INFO'] = path
+        return environ
+
+    @staticmethod
+    def climbs(path):
+        """
+        Whether the (unquoted) path has ".." segments.
+        """
+        return '..' in re.split(r'[/\\]', path)
+
+    def get_cache_key(self, storage, environ):
+        credentials = [environ.get(name, '') for name in self.CREDENTIALS]
+        credentials.append(environ['QUERY_STRING'])
+        digest = hashlib.sha1('\0'.join(credentials)).hexdigest()
+        return (storage.path, storage.get_generation(), int(time.time() / self.TTL),
+                Context.normalize_path(environ['PATH_INFO']), digest)
+
+    @staticmethod
+    def is_authz(environ):
+        query = environ.get('QUERY_STRING', '')
+        return 'action=authz' in query \
+            and urlparse.parse_qs(query).get('action') == ['authz']
+
+
 class FileApp(PasteFileApp):
+    # files from this size are read ahead more aggressively
+    SEQUENTIAL_SIZE = 1024 * 1024
+
     def guess_type(self):
         # add UTF-8 by default to text content-types
         guess = PasteFileApp.guess_type(self)
@@ -437,6 +846,84 @@ class FileApp(PasteFileApp):
             content_type += "; charset=UTF-8"
         return (content_type, guess[1])
 
+    def get(self, environ, start_response):
+        # same as paste's, but wsgi.file_wrapper is only given whole files
+        # (unless it can send a part of them), as it would send the file
+        # up to its end
+        is_head = environ['REQUEST_METHOD'].upper() == 'HEAD'
+        if 'assnet.sendfile' in environ and not is_head:
+            retval = self.offload(environ, start_response, *environ['assnet.sendfile'])
+            if retval is not None:
+                return retval
+        if 'max-age=0' in CACHE_CONTROL(environ).lower():
+            self.update(force=True)
+        else:
+            self.update()
+        if self.content:
+            retval = DataApp.get(self, environ, start_response)
+            return [''] if is_head else retval
+        try:
+            fp = open(self.filename, 'rb')
+        except (IOError, OSError), e:
+            if not os.path.exists(self.filename):
+                return HTTPNotFound('The resource does not exist')(environ, start_response)
+            return HTTPForbidden('You are not permitted to view this file (%s)' % e) \
+                (environ, start_response)
+        retval = DataApp.get(self, environ, start_response)
+        if isinstance(retval, list) or is_head:
+            fp.close()
+            return [''] if is_head else retval
+        lower, content_length = retval
+        fp.seek(lower)
+        if content_length >= self.SEQUENTIAL_SIZE:
+            fadvise_sequential(fp.fileno(), lower, content_length)
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if getattr(file_wrapper, 'sized', False):
+            return file_wrapper(fp, BLOCK_SIZE, content_length)
+        if file_wrapper and content_length == self.content_length:
+            return file_wrapper(fp, BLOCK_SIZE)
+        return _FileIter(fp, size=content_length)
+
+    def offload(self, environ, start_response, header, prefix, root):
+        """
+        Only send the headers, with the path of the file in the header,
+        so the front-end server sends the file and handles Range requests.
+        X-Accel-Redirect takes an URL: prefix must be an internal location
+        of nginx aliased to the root of the working tree, and files outside
+        of it are not offloaded (returns None).
+        """
+        try:
+            self.update()
+        except OSError:
+            return HTTPNotFound('The resource does not exist')(environ, start_response)
+        if header.lower() == 'x-accel-redirect':
+            path = self.get_relative_path(root)
+            if path is None:
+                return None
+        else:
+            path = os.path.realpath(self.filename)
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        if header.lower() == 'x-accel-redirect':
+            path = quote_path(prefix.rstrip('/') + path)
+        headers = [(key, value) for key, value in self.headers
+                   if key.lower() != 'accept-ranges']
+        headers.append((header, path))
+        start_response('200 OK', headers)
+        return ['']
+
+
+    def get_relative_path(self, root):
+        """
+        Get the path of the file from root, as given or with its symlinks
+        resolved, or None if it is outside of it.
+        """
+        for path in (os.path.abspath(self.filename), os.path.realpath(self.filename)):
+            relpath = os.path.relpath(path, root)
+            if relpath != os.pardir and not relpath.startswith(os.pardir + os.sep):
+                return '/' + relpath
+        return None
+
 
 class Server(object):
     def __init__(self, root=None, default_env=None):
@@ -446,12 +933,24 @@ class Server(object):
         will be used.
         """
         self.butt = Butt(router=Router())
+        self.authz = AuthzApp()
         self.default_env = default_env or {}
         if root:
             self.default_env['ASSNET_ROOT'] = root
 
-    def bind(self, hostname, port):
-        httpserver.serve(self, host=hostname, port=str(port))
+    def bind(self, hostname, port, workers=0, max_requests=0, async=False):
+        """
+        Serve HTTP requests.
+        With workers, use this number of processes instead of only threads.
+        With async, use an event loop for connections, and threads only
+        to run the application.
+        """
+        if workers:
+            PreforkServer(self, hostname, port, workers, max_requests).serve()
+        elif async:
+            AsyncServer(self, hostname, port).serve()
+        else:
+            httpserver.serve(self, host=hostname, port=str(port), handler=WSGIHandler)
 
     def __call__(self, environ, start_response):
         """
@@ -460,6 +959,8 @@ class Server(object):
         for key, value in self.default_env.iteritems():
             environ.setdefault(key, value)
         try:
+            if AuthzApp.is_authz(environ):
+                return self.authz(environ, start_response)
             ctx = Context(self.butt, environ, start_response)
             Dispatcher(ctx).dispatch()
             return ctx.respond()
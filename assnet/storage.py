@@ -20,8 +20,15 @@
 
 import os
 import sys
-from ConfigParser import RawConfigParser
-
+import fcntl
+import hashlib
+from time import time
+from contextlib import contextmanager
+from tempfile import mkstemp
+
+from .backends import FileBackend, BACKENDS
+from .cache import LRUCache
+from .data import DataPaths
 from .users import Group, User, Anonymous
 from .files import File, UnknownFile
 from .obj import IObject, ConfigDict
@@ -31,11 +38,13 @@ __all__ = ['Storage']
 
 
 class GlobalConfig(IObject):
+    CONFNAME = 'config'
+
     def __str__(self):
         return '<global>'
 
     def _get_confname(self):
-        return 'config'
+        return self.CONFNAME
 
 
 class GroupsConfig(IObject, dict):
@@ -62,6 +71,51 @@ class GroupsConfig(IObject, dict):
             self.data[name]['description'] = group.description
 
 
+class KeysIndex(IObject):
+    """
+    Find users by their key without reading all of them.
+    Keys are stored hashed, and are always checked against the user afterwards.
+    """
+
+    def _get_confname(self):
+        return 'keys'
+
+    @staticmethod
+    def hash_key(key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get_username(self, key):
+        return self.data['keys'].get(self.hash_key(key))
+
+    def set_key(self, username, old_key, new_key):
+        if old_key and self.data['keys'].get(self.hash_key(old_key)) == username:
+            del self.data['keys'][self.hash_key(old_key)]
+        if new_key:
+            self.data['keys'][self.hash_key(new_key)] = username
+
+    def is_outdated(self):
+        """
+        Check if a user was written since the index, i.e. edited by hand.
+        """
+        mtime = self.storage._get_mtime(self._confname)
+        if mtime is None:
+            return True
+        for name in self.storage.backend.iter_names('users'):
+            # mtimes are in seconds, so in doubt it is outdated
+            user_mtime = self.storage._get_mtime(os.path.join('users', name))
+            if user_mtime is not None and user_mtime >= mtime:
+                return True
+        return False
+
+    def rebuild(self):
+        with self.storage.lock(self._confname):
+            self.data['keys'] = {}
+            for user in self.storage.iter_users():
+                if user.key:
+                    self.data['keys'][self.hash_key(user.key)] = user.name
+            self.save()
+
+
 class Storage(object):
     DIRNAME = '.assnet'
     DATA_PATHS = [os.path.realpath(os.path.join(
@@ -74,10 +128,50 @@ class Storage(object):
                     os.path.join(sys.prefix, 'local', 'share')])
             ).split(':')
         ]
+    DEFAULT_BACKEND = 'file'
+    # when the keys index was last checked, per storage path, as
+    # (generation, time); users edited by hand are only found after
+    # the generation changes, or after KEYS_CHECK_DELAY seconds
+    KEYS_CHECKS = LRUCache(10)
+    KEYS_CHECK_DELAY = 60
+    # names of the users with permissions of their own, per storage
+    # path, as (generation, names)
+    USERS_WITH_PERMS = LRUCache(10)
 
     def __init__(self, path):
         self.path = path
-        self.DATA_PATHS.insert(0, os.path.realpath(os.path.join(self.path, 'data')))
+        # the data directory of the storage has the priority
+        self.data_paths = [os.path.realpath(os.path.join(self.path, 'data'))] + self.DATA_PATHS
+        # the global configuration is always in a file, since it tells
+        # which backend to use for the other objects.
+        self.config_backend = FileBackend(path)
+        self._backend = None
+        # objects read by most requests, shared until the generation changes
+        self._snapshots = {}
+        self._snapshots_generation = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = self.get_backend_class()(self.path)
+        return self._backend
+
+    def get_backend_class(self):
+        config = self.config_backend.read(GlobalConfig.CONFNAME) or ConfigDict()
+        name = config['storage'].get('backend', self.DEFAULT_BACKEND)
+        return BACKENDS[name]
+
+    def _get_backend(self, name):
+        if name == GlobalConfig.CONFNAME:
+            return self.config_backend
+        return self.backend
+
+    @property
+    def data(self):
+        """
+        DataPaths of the storage, to find assets and templates.
+        """
+        return DataPaths.get(self.data_paths)
 
     @property
     def root(self):
@@ -132,25 +226,116 @@ class Storage(object):
             return Anonymous()
         return user
 
+    def get_user_by_key(self, key):
+        """
+        Get the user having that key.
+        Returns None if no user is found.
+        """
+        if not key:
+            return None
+        index = self.get_keysindex()
+        user = self._get_indexed_user(index, key)
+        if user is None and self._check_keysindex() and index.is_outdated():
+            index.rebuild()
+            # the rebuild changed the generation
+            self.KEYS_CHECKS.set(self.path, (self.get_generation(), time()))
+            user = self._get_indexed_user(index, key)
+        return user
+
+    def _check_keysindex(self):
+        """
+        Tell if the keys index should be checked against the users,
+        i.e. on unknown keys; at most once per generation and delay.
+        """
+        generation = self.get_generation()
+        checked = self.KEYS_CHECKS.get(self.path)
+        if checked is not None and checked[0] == generation \
+                and time() - checked[1] < self.KEYS_CHECK_DELAY:
+            return False
+        self.KEYS_CHECKS.set(self.path, (generation, time()))
+        return True
+
+    def _get_indexed_user(self, index, key):
+        name = index.get_username(key)
+        if name:
+            user = self.get_user(name)
+            if user.exists and user.key == key:
+                return user
+
+    def get_users_with_perms(self):
+        """
+        Get the names of the users with permissions of their own on any file.
+        All the configurations are only read once per generation.
+        """
+        generation = self.get_generation()
+        cached = self.USERS_WITH_PERMS.get(self.path)
+        if generation is not None and cached is not None and cached[0] == generation:
+            return cached[1]
+        names = set()
+        for f in self.iter_files():
+            for key in f.perms:
+                if key.startswith('u.'):
+                    names.add(key[2:])
+        self.USERS_WITH_PERMS.set(self.path, (generation, names))
+        return names
+
+    def get_keysindex(self, build=True):
+        """
+        Get the index of user keys.
+        If it does not exist yet, it is built unless build is False.
+        """
+        index = KeysIndex(self)
+        index.read()
+        if not index.exists and build:
+            index.rebuild()
+        return index
+
+    @contextmanager
+    def lock(self, name):
+        """
+        Lock an object against other processes and threads,
+        for read-modify-write updates.
+        """
+        # opened read-only, so watchers do not see it as a change
+        fd = os.open(os.path.join(self.path, '.%s.lock' % name.replace('/', '_')),
+                     os.O_RDONLY | os.O_CREAT, 0660)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
     def iter_users(self):
         """
         Get all stored users.
         """
-        usersdir = os.path.join(self.path, 'users')
-        if os.path.exists(usersdir):
-            for name in sorted(os.listdir(usersdir)):
-                user = self.get_user(name)
-                yield user
+        for name in self.backend.iter_names('users'):
+            user = self.get_user(name)
+            yield user
 
     def iter_files(self):
         """
         Get all files with a stored configuration.
         """
-        filesdir = os.path.join(self.path, 'files')
-        if os.path.exists(filesdir):
-            for hsh in sorted(os.listdir(filesdir)):
-                f = UnknownFile(self, hsh)
-                yield f
+        for hsh in self.backend.iter_names('files'):
+            f = UnknownFile(self, hsh)
+            yield f
+
+    def iter_object_names(self):
+        """
+        Get the names of all the stored objects, except the global configuration.
+        """
+        for name in ('groups', 'keys'):
+            yield name
+        for dirname in ('users', 'files'):
+            for name in self.backend.iter_names(dirname):
+                yield '%s/%s' % (dirname, name)
+
+    def transaction(self):
+        """
+        Context manager to write several objects at once, if the backend supports it.
+        """
+        return self.backend.transaction()
 
     def user_exists(self, name):
         """
@@ -178,52 +363,81 @@ class Storage(object):
         f.read()
         return f
 
+    def get_files(self, paths):
+        """
+        Get several files at once, reading their configurations
+        together if the backend supports it.
+        """
+        files = [File(self, path) for path in paths]
+        objects = self.backend.read_many([f._get_confname() for f in files])
+        for f in files:
+            f._load(*objects[f._get_confname()])
+        return files
+
     def get_groupscfg(self):
-        groups = GroupsConfig(self)
-        groups.read()
-        return groups
+        return self._get_snapshot(GroupsConfig)
 
     def get_config(self):
-        cfg = GlobalConfig(self)
-        cfg.read()
-        return cfg
+        return self._get_snapshot(GlobalConfig)
+
+    def _get_snapshot(self, cls):
+        """
+        Get an object shared by all the callers using this storage
+        (usually, during one request), as long as no object is written.
+        Without generation, fall back to checking the object mtime.
+        """
+        generation = self.get_generation()
+        if generation != self._snapshots_generation:
+            self._snapshots.clear()
+            self._snapshots_generation = generation
+        obj = self._snapshots.get(cls)
+        if obj is None:
+            obj = self._snapshots[cls] = cls(self)
+            obj.read()
+        elif generation is None and not obj.is_modified():
+            obj.read()
+        return obj
 
     def _read(self, name):
-        path = os.path.join(self.path, name)
-        config = RawConfigParser()
+        return self._get_backend(name).read(name)
+
+    def get_generation(self):
+        """
+        Identify the current state of the stored objects.
+        It changes every time an object is written or removed.
+        Returns a (token, mtime) tuple, or None if unknown.
+        """
         try:
-            with open(path, 'r') as fp:
-                config.readfp(fp)
-        except IOError:
+            with open(os.path.join(self.path, 'generation'), 'rb') as fp:
+                token = fp.read(64)
+                st = os.fstat(fp.fileno())
+        except (IOError, OSError):
             return None
+        # mtimes are too coarse to tell close changes apart, and inodes
+        # are reused; files written by older versions are empty
+        return (token or st.st_ino, st.st_mtime)
 
-        data = ConfigDict()
-        for sec in config.sections():
-            data[sec] = dict([(k, v.decode('utf-8')) for k, v in config.items(sec)])
-
-        return data
+    def touch(self):
+        """
+        Change the generation of the stored objects.
+        """
+        fd, tmppath = mkstemp(dir=self.path, prefix='.generation')
+        try:
+            os.write(fd, os.urandom(8).encode('hex'))
+        finally:
+            os.close(fd)
+        os.rename(tmppath, os.path.join(self.path, 'generation'))
 
     def _write(self, name, data):
-        path = os.path.join(self.path, name)
-        destdir = os.path.dirname(path)
-        if not os.path.exists(destdir):
-            os.makedirs(destdir)
-        config = RawConfigParser()
-        for sec, items in data.iteritems():
-            config.add_section(sec)
-            for key, value in items.iteritems():
-                if isinstance(value, unicode):
-                    value = value.encode('utf-8')
-                if value is not None:
-                    config.set(sec, key, value)
-        with open(path, 'wb') as fp:
-            config.write(fp)
+        self._get_backend(name).write(name, data)
+        self.touch()
 
     def _get_mtime(self, name):
-        path = os.path.join(self.path, name)
-        if os.path.exists(path):
-            return int(os.path.getmtime(path))
+        return self._get_backend(name).get_mtime(name)
 
     def _remove(self, name):
-        path = os.path.join(self.path, name)
-        os.unlink(path)
+        self._get_backend(name).remove(name)
+        self.touch()
+
+    def _get_path(self, name):
+        return self._get_backend(name).get_path(name)
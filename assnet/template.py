@@ -18,29 +18,54 @@
 # along with assnet. If not, see <http://www.gnu.org/licenses/>.
 
 import os
+from threading import Lock
 
 from mako.lookup import TemplateLookup
 from paste.url import URL
 from urlparse import urlsplit, urlunsplit
 
 from .storage import Storage
+from .data import DataPaths
 from .version import VERSION
 
 
+# TemplateLookup objects of the process, by template directories
+LOOKUPS = {}
+LOOKUPS_LOCK = Lock()
+
+
 def build_lookup(storage):
     """
     Get the Mako TemplateLookup.
     If a Storage object is provided (it should be most of the time),
-    it will also use its data directory.
+    it will also use its data directory, and keep the compiled templates
+    in its cache directory.
+    The lookups are shared by the whole process, so templates are only
+    compiled once.
+    """
+    paths = get_data(storage).get_dirs('templates')
+    module_directory = os.path.join(storage.path, 'cache', 'templates') if storage else None
+    key = (tuple(paths), module_directory)
+
+    with LOOKUPS_LOCK:
+        lookup = LOOKUPS.get(key)
+        if lookup is None:
+            imports = ['from assnet.filters import compact as cpt, quote_and_decode_url as U',
+                    'from paste.url import URL']
+            lookup = TemplateLookup(directories=paths, collection_size=20,
+                             module_directory=module_directory,
+                             output_encoding='utf-8', input_encoding='utf-8',
+                             default_filters=['decode.utf8'],
+                             imports=imports)
+            LOOKUPS[key] = lookup
+        return lookup
+
+
+def get_data(storage):
     """
-    data_paths = storage.DATA_PATHS if storage else Storage.DATA_PATHS
-    paths = [os.path.join(path, 'templates') for path in data_paths]
-    imports = ['from assnet.filters import compact as cpt, quote_and_decode_url as U',
-            'from paste.url import URL']
-    return TemplateLookup(directories=paths, collection_size=20,
-                     output_encoding='utf-8', input_encoding='utf-8',
-                     default_filters=['decode.utf8'],
-                     imports=imports)
+    Get the DataPaths of the Storage, or the default one.
+    """
+    return storage.data if storage else DataPaths.get(Storage.DATA_PATHS)
 
 
 def build_vars(storage):
@@ -68,6 +93,21 @@ def build_root_url(storage):
             return URL(root_url.encode('utf-8'))
 
 
+def build_asset_url(root_url, data, filename):
+    """
+    Build the URL of an asset.
+    It includes the hash of its contents, so it can be cached forever.
+    root_url: URL (paste.url)
+    data: DataPaths
+    filename: str
+    """
+    url = root_url.setvar(action='asset', file=filename)
+    asset_hash = data.get_asset_hash(filename)
+    if asset_hash:
+        url = url.setvar(v=asset_hash)
+    return url
+
+
 def build_url(root_url, f, user=None, use_key=True, http_auth=False):
     """
     Build an URL for a particular file and user if provided.
@@ -23,6 +23,7 @@ __all__ = ['Group', 'IUser', 'User', 'Anonymous']
 
 from .obj import IObject
 from .mail import Mail
+from .perms import PermsResolver
 from .security import new_salt, new_user_key
 
 import os
@@ -44,6 +45,13 @@ class Group(object):
 
 class IUser(object):
     def has_perms(self, f, perm):
+        return self.perms_resolver.has_perms(f, perm)
+
+    def match_perms(self, f):
+        """
+        Get the permissions of the user defined on that very File,
+        or None if they are inherited from its parent.
+        """
         raise NotImplementedError()
 
     def __str__(self):
@@ -58,28 +66,45 @@ class User(IUser, IObject):
         self.password = None
         self.key = None
         self.groups = []
+        self.perms_resolver = PermsResolver(self)
         IObject.__init__(self, storage)
 
-    def has_perms(self, f, perm):
+    def match_perms(self, f):
         f_perms = f.get_user_perms(self.name)
         if f_perms is not None:
-            return f_perms & perm
+            return f_perms
 
         for group in self.groups:
             f_perms = f.get_group_perms(group)
             if f_perms is not None:
-                return f.get_group_perms(group) & perm
+                return f_perms
 
         f_perms = f.get_auth_perms()
         if f_perms is not None:
-            return f_perms & perm
-
-        f_perms = f.get_all_perms()
-        if f_perms is not None:
-            return f_perms & perm
-
-        f_parent = f.parent()
-        return f_parent and self.has_perms(f_parent, perm)
+            return f_perms
+
+        return f.get_all_perms()
+
+    def save(self):
+        old_key = self._old_data['auth'].get('key') if self._old_data else None
+        IObject.save(self)
+        self._update_keysindex(old_key, self.key)
+
+    def remove(self):
+        old_key = self.key
+        IObject.remove(self)
+        self._update_keysindex(old_key, None)
+
+    def _update_keysindex(self, old_key, new_key):
+        if old_key == new_key:
+            return
+        # a missing index will be entirely built when needed
+        with self.storage.lock('keys'):
+            # read it again, another process could have changed it
+            index = self.storage.get_keysindex(build=False)
+            if index.exists:
+                index.set_key(self.name, old_key, new_key)
+                index.save()
 
     def new_mail(self, template, subject):
         config = self.storage.get_config()
@@ -149,14 +174,10 @@ class Anonymous(IUser):
     def __init__(self, fake_name=None):
         if fake_name:
             self.name = fake_name
+        self.perms_resolver = PermsResolver(self)
 
-    def has_perms(self, f, perm):
-        f_perms = f.get_all_perms()
-        if f_perms is not None:
-            return f_perms & perm
-
-        f_parent = f.parent()
-        return f_parent and self.has_perms(f_parent, perm)
+    def match_perms(self, f):
+        return f.get_all_perms()
 
     def is_valid_password(self, password):
         return False
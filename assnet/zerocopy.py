@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2011 Romain Bignon, Laurent Bachelier
+#
+# This file is part of assnet.
+#
+# assnet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# assnet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with assnet. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+import os
+import sys
+import errno
+import socket
+import select
+import ctypes
+import ctypes.util
+
+from paste import httpserver
+from paste.fileapp import BLOCK_SIZE
+
+
+__all__ = ['sendfile', 'fadvise_sequential', 'SENDFILE_SUPPORT',
+           'FileWrapper', 'FileWrapperFactory', 'WSGIHandler']
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        return ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    except OSError:
+        return None
+
+_libc = _load_libc()
+
+
+if hasattr(os, 'sendfile'):
+    def sendfile(out_fd, in_fd, offset, count):
+        """
+        Copy count bytes of in_fd, from offset, to out_fd in the kernel.
+        Returns the number of bytes sent.
+        """
+        return os.sendfile(out_fd, in_fd, offset, count)
+    SENDFILE_SUPPORT = True
+else:
+    try:
+        from sendfile import sendfile
+        SENDFILE_SUPPORT = True
+    except ImportError:
+        _sendfile = getattr(_libc, 'sendfile64', None) or getattr(_libc, 'sendfile', None)
+        SENDFILE_SUPPORT = _sendfile is not None
+
+        def sendfile(out_fd, in_fd, offset, count):
+            """
+            Copy count bytes of in_fd, from offset, to out_fd in the kernel.
+            Returns the number of bytes sent.
+            """
+            if _sendfile is None:
+                raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+            offset = ctypes.c_int64(offset)
+            sent = _sendfile(out_fd, in_fd, ctypes.byref(offset), ctypes.c_size_t(count))
+            if sent < 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err))
+            return sent
+
+
+POSIX_FADV_SEQUENTIAL = 2
+
+
+def fadvise_sequential(fd, offset=0, length=0):
+    """
+    Tell the kernel the file will be read sequentially, so it reads ahead more.
+    Does nothing if it is not supported.
+    """
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_SEQUENTIAL)
+    elif _libc is not None and hasattr(_libc, 'posix_fadvise'):
+        _libc.posix_fadvise(fd, ctypes.c_int64(offset), ctypes.c_int64(length),
+                            POSIX_FADV_SEQUENTIAL)
+
+
+class FileWrapper(object):
+    """
+    wsgi.file_wrapper of assnet's servers.
+    It sends size bytes (or up to the end) from the current position of the file.
+    If the server provides its socket, the file is sent with sendfile(),
+    otherwise it is read by blocks.
+    """
+
+    def __init__(self, fp, block_size=BLOCK_SIZE, size=None, sock=None):
+        self.file = fp
+        self.block_size = block_size
+        self.size = size
+        self.sock = sock
+
+    def __iter__(self):
+        if self.sock is not None and SENDFILE_SUPPORT:
+            # let the server send the headers first
+            yield ''
+            self.sendfile(self.sock)
+            return
+        size = self.size
+        while size is None or size > 0:
+            data = self.file.read(self.block_size if size is None else min(self.block_size, size))
+            if not data:
+                return
+            if size is not None:
+                size -= len(data)
+            yield data
+
+    def sendfile(self, sock):
+        """
+        Send the file to a blocking socket.
+        """
+        offset = self.file.tell()
+        size = self.size
+        if size is None:
+            size = os.fstat(self.file.fileno()).st_size - offset
+        while size > 0:
+            try:
+                sent = sendfile(sock.fileno(), self.file.fileno(), offset, size)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno != errno.EAGAIN:
+                    # let the server handle it like any other socket error
+                    raise socket.error(e.errno, e.strerror)
+                # the socket has a timeout, so it is non-blocking
+                if not select.select([], [sock], [], sock.gettimeout())[1]:
+                    raise socket.timeout('timed out')
+                continue
+            if not sent:
+                break
+            offset += sent
+            size -= sent
+
+    def close(self):
+        self.file.close()
+
+
+class FileWrapperFactory(object):
+    """
+    Build FileWrapper objects for a connection.
+    Unlike other wsgi.file_wrapper, they can send only a part of a file.
+    """
+    sized = True
+
+    def __init__(self, sock=None):
+        self.sock = sock
+
+    def __call__(self, fp, block_size=BLOCK_SIZE, size=None):
+        return FileWrapper(fp, block_size, size, self.sock)
+
+
+class WSGIHandler(httpserver.WSGIHandler):
+    """
+    paste's handler, providing a wsgi.file_wrapper which uses sendfile().
+    """
+
+    def wsgi_setup(self, environ=None):
+        httpserver.WSGIHandler.wsgi_setup(self, environ)
+        # the kernel can not encrypt TLS connections
+        sock = None if hasattr(self.connection, 'get_context') else self.connection
+        self.wsgi_environ['wsgi.file_wrapper'] = FileWrapperFactory(sock)
@@ -1,5 +1,7 @@
 from assnet.storage import Storage
+from assnet.users import User
 from assnet.server import Server
+from assnet.cli import CLI
 
 from unittest import TestCase
 from webtest import TestApp
@@ -65,3 +67,188 @@ class ApiTest(TestCase):
         assert data['type'] == 'file'
         assert data['size'] == 17
         assert datetime.strptime(data['mtime'], '%Y-%m-%dT%H:%M:%S').year > 0
+
+    def test_conditionalGet(self):
+        res = self.app.get('/?view=rss', status=200)
+        etag = res.headers['ETag']
+        assert 'Last-Modified' in res.headers
+        res = self.app.get('/?view=rss', headers={'If-None-Match': etag}, status=304)
+        assert len(res.body) == 0
+        # other views have their own validators
+        res = self.app.get('/?view=text_list', headers={'If-None-Match': etag}, status=200)
+        assert len(res.body.split('\n')) == 3
+
+        # a file edited deep in the tree
+        with open(os.path.join(self.root, 'penguins', 'gentoo'), 'w') as f:
+            f.write('The best penguin, really.')
+        res = self.app.get('/?view=rss', headers={'If-None-Match': etag}, status=200)
+        assert 'penguins/gentoo' in res.body
+        etag = res.headers['ETag']
+
+        # a configuration change
+        storage = Storage.lookup(self.root)
+        f = storage.get_file('/penguins/gentoo')
+        f.perms['all'] = 0
+        f.save()
+        res = self.app.get('/?view=rss', headers={'If-None-Match': etag}, status=200)
+        assert 'penguins/gentoo' not in res.body
+
+    def test_rssEntries(self):
+        os.mkdir(os.path.join(self.root, 'penguins', 'colony'))
+        for i in xrange(30):
+            path = os.path.join(self.root, 'penguins', 'colony', 'penguin%02d.txt' % i)
+            with open(path, 'w') as f:
+                f.write('Penguin %d. ' % i * (1000 if i == 29 else 1))
+            os.utime(path, (1000000 + i, 1000000 + i))
+        hidden = os.path.join(self.root, 'penguins', 'colony', 'penguin99.txt')
+        with open(hidden, 'w') as f:
+            f.write('Hidden.')
+        storage = Storage.lookup(self.root)
+        f = storage.get_file('/penguins/colony/penguin99.txt')
+        f.perms['all'] = 0
+        f.save()
+        # the files of the setup are the most recent
+        for path in ('penguins_are_cute', 'penguins/gentoo', 'penguins/emperor'):
+            os.utime(os.path.join(self.root, path), (2000000, 2000000))
+
+        res = self.app.get('/?view=rss', status=200)
+        assert res.body.count('<item>') == 20
+        assert 'penguin99' not in res.body
+        assert 'penguin12' not in res.body
+        assert res.body.index('penguin29') < res.body.index('penguin28') < res.body.index('penguin13')
+        # long texts are cut
+        assert 'Penguin 29. ' * 300 in res.body
+        assert 'Penguin 29. ' * 1000 not in res.body
+
+        # long HTML documents are cut to their text
+        with open(os.path.join(self.root, 'penguins', 'colony', 'king.html'), 'w') as f:
+            f.write('<html><head><style>p { color: red; }</style></head><body>')
+            f.write('<p class="king">King &amp; <b>queen</b>.</p>' * 200)
+            f.write('</body></html>')
+        res = self.app.get('/?view=rss', status=200)
+        description = res.body.split('king.html')[1].split('</description>')[0]
+        assert 'King &amp;amp; queen' in description
+        assert 'color' not in description
+        assert 'class=' not in description and '&lt;b' not in description
+
+    def test_recentIndex(self):
+        os.utime(os.path.join(self.root, 'penguins', 'emperor'), (2000000, 2000000))
+        with open(os.path.join(self.root, 'penguins', 'rockhopper.txt'), 'w') as f:
+            f.write('Yellow feathers.')
+        os.utime(os.path.join(self.root, 'penguins', 'rockhopper.txt'), (3000000, 3000000))
+        assert CLI(self.root).main(['assnet_test', 'index', 'update']) in (0, None)
+
+        res = self.app.get('/?view=rss', status=200)
+        etag = res.headers['ETag']
+        assert res.body.count('<item>') == 4
+        assert res.body.index('penguins_are_cute') < res.body.index('penguins / rockhopper') \
+            < res.body.index('penguins / emperor')
+        res = self.app.get('/penguins/?view=blog', status=200)
+        assert 'Yellow feathers.' in res.body
+
+        # new and removed files are found from the changed directories
+        with open(os.path.join(self.root, 'penguins', 'adelie'), 'w') as f:
+            f.write('Cute.')
+        os.unlink(os.path.join(self.root, 'penguins_are_cute'))
+        res = self.app.get('/?view=rss', headers={'If-None-Match': etag}, status=200)
+        assert 'penguins / adelie' in res.body
+        assert 'penguins_are_cute' not in res.body
+        assert '.assnet' not in res.body
+        etag = res.headers['ETag']
+        os.makedirs(os.path.join(self.root, 'penguins', 'colony', 'gentoo'))
+        with open(os.path.join(self.root, 'penguins', 'colony', 'gentoo', 'chick.txt'), 'w') as f:
+            f.write('Fluffy.')
+        res = self.app.get('/?view=rss', headers={'If-None-Match': etag}, status=200)
+        assert 'gentoo / chick' in res.body
+        res = self.app.get('/penguins/?view=blog', status=200)
+        assert 'Fluffy.' in res.body
+
+        # files written in place can need an update
+        with open(os.path.join(self.root, 'penguins', 'emperor'), 'w') as f:
+            f.write('Tallest.')
+        assert CLI(self.root).main(['assnet_test', 'index', 'update',
+                                    os.path.join(self.root, 'penguins', 'emperor')]) in (0, None)
+        res = self.app.get('/?view=rss', status=200)
+        assert res.body.index('penguins / emperor') < res.body.index('penguins / rockhopper')
+
+        # permissions still apply
+        storage = Storage.lookup(self.root)
+        f = storage.get_file('/penguins')
+        f.perms['all'] = 0
+        f.save()
+        res = self.app.get('/?view=rss', status=200)
+        assert 'penguins / ' not in res.body
+
+    def test_responseCache(self):
+        storage = Storage.lookup(self.root)
+        config = storage.get_config()
+        config.data['web']['response_cache'] = 'disk'
+        config.save()
+        cachedir = os.path.join(storage.path, 'cache', 'responses')
+
+        res = self.app.get('/penguins/?view=text_list', status=200)
+        assert sorted(res.body.split('\n')) == ['emperor', 'gentoo']
+        assert len(os.listdir(cachedir)) == 1
+        # the next responses come from the cache
+        path = os.path.join(cachedir, os.listdir(cachedir)[0])
+        with open(path) as f:
+            state, content_type, body = f.read().split('\n', 2)
+        with open(path, 'w') as f:
+            f.write('\n'.join((state, content_type, 'gentoo')))
+        res = self.app.get('/penguins/?view=text_list', status=200)
+        assert res.body == 'gentoo'
+        assert res.content_type == 'text/plain'
+
+        # until the directory changes
+        with open(os.path.join(self.root, 'penguins', 'adelie'), 'w') as f:
+            f.write('Cute.')
+        res = self.app.get('/penguins/?view=text_list', status=200)
+        assert sorted(res.body.split('\n')) == ['adelie', 'emperor', 'gentoo']
+
+    def test_sharedResponses(self):
+        storage = Storage.lookup(self.root)
+        for name, key in (('penguin', 'fabf37d746da8a45df63489f642b3813'),
+                          ('platypus', 'c4f2ed3a5b8d7e6f1a0b9c8d7e6f5a4b')):
+            user = User(storage, name)
+            user.key = key
+            user.save()
+        # same permissions, same response
+        res1 = self.app.get('/penguins/?view=text_list&authkey=fabf37d746da8a45df63489f642b3813')
+        res2 = self.app.get('/penguins/?view=text_list&authkey=c4f2ed3a5b8d7e6f1a0b9c8d7e6f5a4b')
+        assert res1.etag == res2.etag
+
+        f = storage.get_file('/penguins/gentoo')
+        f.perms['u.penguin'] = 0
+        f.save()
+        res1 = self.app.get('/penguins/?view=text_list&authkey=fabf37d746da8a45df63489f642b3813')
+        res2 = self.app.get('/penguins/?view=text_list&authkey=c4f2ed3a5b8d7e6f1a0b9c8d7e6f5a4b')
+        assert res1.etag != res2.etag
+        assert res1.body == 'emperor'
+        assert sorted(res2.body.split('\n')) == ['emperor', 'gentoo']
+
+    def test_relativeRoot(self):
+        storage = Storage.lookup(self.root)
+        config = storage.get_config()
+        config.data['web']['response_cache'] = 'disk'
+        config.save()
+        cachedir = os.path.join(storage.path, 'cache', 'responses')
+
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        try:
+            app = TestApp(Server('.'))
+            res = app.get('/?view=rss', status=200)
+            # the storage is not part of the tree, even with a relative root
+            app.get('/?view=rss', headers={'If-None-Match': res.etag}, status=304)
+            # and the next identical request comes from the response cache
+            assert len(os.listdir(cachedir)) == 1
+            path = os.path.join(cachedir, os.listdir(cachedir)[0])
+            with open(path) as f:
+                state, content_type, body = f.read().split('\n', 2)
+            with open(path, 'w') as f:
+                f.write('\n'.join((state, content_type, 'cached')))
+            res2 = app.get('/?view=rss', status=200)
+            assert res2.etag == res.etag
+            assert res2.body == 'cached'
+        finally:
+            os.chdir(cwd)
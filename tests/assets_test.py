@@ -1,5 +1,6 @@
 from assnet.storage import Storage
 from assnet.server import Server
+from assnet.cli import CLI
 
 from unittest import TestCase
 from webtest import TestApp
@@ -7,6 +8,10 @@ from webtest import TestApp
 from tempfile import mkdtemp
 import os
 import shutil
+import hashlib
+import re
+from gzip import GzipFile
+from contextlib import closing
 
 
 class AssetsTest(TestCase):
@@ -39,9 +44,70 @@ class AssetsTest(TestCase):
 
         self.app.get('/?action=asset&file=../../.assnet/config', status=412)
 
+    def test_unknownType(self):
+        with open(os.path.join(self.root, 'test_data', 'assets', 'penguin.unknownext'), 'w') as f:
+            f.write('penguin')
+        res = self.app.get('/?action=asset&file=penguin.unknownext', status=200)
+        assert res.body == 'penguin'
+        # not compressed
+        assert 'Vary' not in res.headers
+        assert CLI(self.root).main(['assnet_test', 'assets', 'build']) in (0, None)
+
     def test_stylesheets(self):
+        asset_hash = hashlib.sha1('body { background-color: pink; }').hexdigest()[:12]
+        link = '<link rel="stylesheet" type="text/css" href="/?action=asset&amp;file=main.css&amp;v=%s" />' % asset_hash
         res = self.app.get('/?view=list', status=200)
-        assert '<link rel="stylesheet" type="text/css" href="/?action=asset&amp;file=main.css" />' in res.body
+        assert link in res.body
 
         res = self.app.get('/test_data/?view=medialist', status=200)
-        assert '<link rel="stylesheet" type="text/css" href="/?action=asset&amp;file=main.css" />' in res.body
+        assert link in res.body
+
+    def test_fingerprintedAsset(self):
+        asset_hash = hashlib.sha1('body { background-color: pink; }').hexdigest()[:12]
+        res = self.app.get('/?action=asset&file=main.css&v=%s' % asset_hash, status=200)
+        assert res.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+
+        # outdated hash
+        res = self.app.get('/?action=asset&file=main.css&v=0123456789ab', status=200)
+        assert res.headers['Cache-Control'] == 'public, max-age=86400'
+        assert 'body { background-color: pink; }' == res.body
+
+        # edited after the assets were indexed
+        with open(os.path.join(self.root, 'test_data', 'assets', 'main.css'), 'w') as f:
+            f.write('body { background-color: black; }')
+        res = self.app.get('/?action=asset&file=main.css&v=%s' % asset_hash, status=200)
+        assert res.headers['Cache-Control'] == 'public, max-age=86400'
+        new_hash = hashlib.sha1('body { background-color: black; }').hexdigest()[:12]
+        res = self.app.get('/?view=list', status=200)
+        assert 'file=main.css&amp;v=%s' % new_hash in res.body
+        res = self.app.get('/?action=asset&file=main.css&v=%s' % new_hash, status=200)
+        assert res.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+        assert 'body { background-color: black; }' == res.body
+
+    def test_buildBundles(self):
+        assert CLI(self.root).main(['assnet_test', 'assets', 'build']) in (0, None)
+        res = self.app.get('/?view=list', status=200)
+        links = re.findall(r'<link rel="stylesheet" type="text/css" href="([^"]+)" />', res.body)
+        assert len(links) == 1
+        scripts = re.findall(r'<script src="([^"]+)"></script>', res.body)
+        # html5.js is only for old browsers
+        assert len(scripts) == 2
+
+        url = links[0].replace('&amp;', '&')
+        res = self.app.get(url, status=200)
+        assert 'body { background-color: pink; }' in res.body
+        assert res.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+        # precompressed next to it
+        storage = Storage.lookup(self.root)
+        with closing(GzipFile(os.path.join(storage.path, 'assets_cache', url.split('=')[-1] + '.gz'))) as f:
+            assert res.body == f.read()
+
+        # outdated by a change of one of its assets
+        with open(os.path.join(self.root, 'test_data', 'assets', 'main.css'), 'w') as f:
+            f.write('body { background-color: navy; color: white; }')
+        res = self.app.get('/?view=list', status=200)
+        links = re.findall(r'<link rel="stylesheet" type="text/css" href="([^"]+)" />', res.body)
+        assert len(links) == 2
+        assert 'file=main.css' in links[0]
+        res = self.app.get(url, status=200)
+        assert res.headers['Cache-Control'] == 'public, max-age=86400'
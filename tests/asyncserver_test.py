@@ -0,0 +1,98 @@
+from assnet.storage import Storage
+from assnet.server import Server
+from assnet.asyncserver import HTTPChannel
+
+from unittest import TestCase
+
+from tempfile import mkdtemp
+from multiprocessing import Process
+import os
+import time
+import shutil
+import socket
+import urllib2
+
+
+class AsyncServerTest(TestCase):
+    def setUp(self):
+        self.root = mkdtemp(prefix='assnet_test_root')
+        Storage.create(self.root)
+        self.data = ''.join([chr(i % 256) for i in xrange(1024 * 1024)])
+        with open(os.path.join(self.root, 'penguins.bin'), 'wb') as f:
+            f.write(self.data)
+
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        self.port = s.getsockname()[1]
+        s.close()
+        self.process = Process(target=Server(self.root).bind,
+                               args=('127.0.0.1', self.port),
+                               kwargs={'async': True})
+        self.process.start()
+
+    def tearDown(self):
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        if self.root:
+            shutil.rmtree(self.root)
+
+    def open(self, path, headers={}):
+        for i in xrange(50):
+            try:
+                return urllib2.urlopen(urllib2.Request(
+                    'http://127.0.0.1:%d%s' % (self.port, path), headers=headers))
+            except urllib2.URLError, e:
+                if isinstance(e, urllib2.HTTPError):
+                    raise
+                time.sleep(0.1)
+        raise AssertionError('No response from the server')
+
+    def test_serve(self):
+        assert 'penguins.bin' in self.open('/').read()
+
+        res = self.open('/penguins.bin')
+        assert res.info()['Content-Length'] == str(len(self.data))
+        assert res.read() == self.data
+
+        res = self.open('/penguins.bin', {'Range': 'bytes=1000-1999'})
+        assert res.getcode() == 206
+        assert res.read() == self.data[1000:2000]
+
+        # several slow clients at once
+        responses = [self.open('/penguins.bin') for i in xrange(20)]
+        for res in responses:
+            assert res.read(10) == self.data[:10]
+        for res in responses:
+            assert res.read() == self.data[10:]
+
+        try:
+            self.open('/nothing')
+        except urllib2.HTTPError, e:
+            assert e.code == 404
+        else:
+            assert False
+
+        self.process.terminate()
+        self.process.join(10)
+        assert self.process.exitcode == 0
+
+    def test_headersTooLarge(self):
+        class FakeServer(object):
+            map = {}
+        a, b = socket.socketpair()
+        channel = HTTPChannel(FakeServer(), a, None)
+        channel.collect_incoming_data('GET / HTTP/1.0\r\n' + 'x' * HTTPChannel.MAX_HEADERS_SIZE)
+        # the rest of the request is ignored
+        channel.collect_incoming_data('x' * 1000)
+        channel.found_terminator()
+        assert channel.data == [] and channel.environ is None
+        channel.close()
+        response = ''
+        while True:
+            data = b.recv(65536)
+            if not data:
+                break
+            response += data
+        b.close()
+        assert response.count('HTTP/1.0 431') == 1
@@ -0,0 +1,113 @@
+from assnet.storage import Storage
+from assnet.backends import SQLiteBackend
+from assnet.cli import CLI
+from assnet.files import File
+from assnet.users import User
+from unittest import TestCase
+from tempfile import mkdtemp
+from StringIO import StringIO
+import shutil
+from threading import Thread
+import sys
+import os
+
+
+class BackendsTest(TestCase):
+    def setUp(self):
+        self.root = mkdtemp(prefix='assnet_test_root')
+        self.storage = Storage.create(self.root)
+
+    def tearDown(self):
+        if self.root:
+            shutil.rmtree(self.root)
+
+    def use_sqlite(self):
+        config = self.storage.get_config()
+        config.data['storage']['backend'] = 'sqlite'
+        config.save()
+        self.storage = Storage.lookup(self.root)
+
+    def test_sqlite(self):
+        self.use_sqlite()
+        assert isinstance(self.storage.backend, SQLiteBackend)
+        assert len(list(self.storage.iter_users())) == 0
+
+        f = self.storage.get_file('/penguin')
+        assert not f.exists
+        f.perms['all'] = File.PERM_READ
+        f.perms['u.Penguin'] = File.PERM_WRITE
+        f.view = 'html'
+        f.save()
+        assert f.exists
+
+        f = self.storage.get_file('/penguin')
+        assert f.exists
+        assert f.view == 'html'
+        assert f.perms == {'all': File.PERM_READ, 'u.penguin': File.PERM_WRITE}
+        assert f.data['info']['path'] == u'/penguin'
+        assert f.data['perms']['all'] == u'1'
+        assert [g.path for g in self.storage.iter_files()] == ['/penguin']
+
+        u = User(self.storage, 'penguin')
+        u.realname = u'Penguin \xe9'
+        u.password = 'monkey1'
+        u.gen_key()
+        u.save()
+        u = self.storage.get_user('penguin')
+        assert u.exists
+        assert u.realname == u'Penguin \xe9'
+        assert u.is_valid_password('monkey1')
+        assert self.storage.get_user_by_key(u.key).name == 'penguin'
+        assert [user.name for user in self.storage.iter_users()] == ['penguin']
+        u.remove()
+        assert not self.storage.get_user('penguin').exists
+
+        # nothing was written in files
+        assert not os.path.exists(os.path.join(self.storage.path, 'users'))
+        assert self.storage._get_path('files/%s' % f.get_hash()) is None
+        assert self.storage._get_path('config') is not None
+
+    def test_sqliteConnections(self):
+        self.use_sqlite()
+        self.storage.get_user('penguin')
+        count = len(SQLiteBackend.CONNECTIONS)
+        # shared by the storages of a thread
+        for i in xrange(10):
+            Storage.lookup(self.root).get_user('penguin')
+        assert len(SQLiteBackend.CONNECTIONS) == count
+
+        # but not between threads
+        thread = Thread(target=lambda: Storage.lookup(self.root).get_user('penguin'))
+        thread.start()
+        thread.join()
+        assert len(SQLiteBackend.CONNECTIONS) == count + 1
+
+        # removing a missing object fails like with files
+        self.assertRaises(OSError, self.storage._remove, 'users/penguin')
+
+        SQLiteBackend.close_all()
+        assert len(SQLiteBackend.CONNECTIONS) == 0
+        assert not self.storage.get_user('penguin').exists
+
+    def test_migrate(self):
+        f = self.storage.get_file('/penguin')
+        f.perms['all'] = File.PERM_READ
+        f.save()
+        u = User(self.storage, 'penguin')
+        u.realname = 'Penguin'
+        u.save()
+
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            assert CLI(self.root).main(['assnet_test', 'storage', 'migrate', 'sqlite']) in (0, None)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        assert output.strip() == 'Migrated 4 objects from "file" to "sqlite".'
+
+        storage = Storage.lookup(self.root)
+        assert isinstance(storage.backend, SQLiteBackend)
+        assert storage.get_file('/penguin').perms['all'] == File.PERM_READ
+        assert storage.get_file('/.assnet').perms['all'] == 0
+        assert storage.get_user('penguin').realname == 'Penguin'
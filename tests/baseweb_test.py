@@ -1,5 +1,6 @@
 from assnet.storage import Storage
-from assnet.server import Server
+from assnet.server import Server, FileApp
+from assnet.template import build_lookup
 
 from unittest import TestCase
 from webtest import TestApp
@@ -33,6 +34,42 @@ class BaseWebTest(TestCase):
         res = self.app.get("/penguins_are_cute")
         assert "HELLO" == res.body
 
+    def test_sendfileOffload(self):
+        with open(os.path.join(self.root, "penguins_are_cute"), 'w') as f:
+            f.write("HELLO")
+        realpath = os.path.realpath(os.path.join(self.root, "penguins_are_cute"))
+
+        res = self.app.get("/penguins_are_cute", extra_environ={'SERVER_SENDFILE': 'lighttpd'})
+        assert res.headers['X-LIGHTTPD-send-file'] == realpath
+        assert res.body == ''
+        # HEAD requests and pages are still answered by assnet
+        res = self.app.head("/penguins_are_cute", extra_environ={'SERVER_SENDFILE': 'lighttpd'})
+        assert 'X-LIGHTTPD-send-file' not in res.headers
+        res = self.app.get("/", extra_environ={'SERVER_SENDFILE': 'lighttpd'})
+        assert "penguins_are_cute" in res.body
+
+        storage = Storage.lookup(self.root)
+        config = storage.get_config()
+        config.data['web']['sendfile_header'] = 'X-Accel-Redirect'
+        config.data['web']['sendfile_prefix'] = '/protected/'
+        config.save()
+        res = self.app.get("/penguins_are_cute")
+        assert res.headers['X-Accel-Redirect'] == '/protected/penguins_are_cute'
+        self.app.get("/nothing", status=404)
+
+        # paths are relative to the working tree, which files outside of
+        # (i.e. thumbnails of a storage elsewhere) can not be
+        assert FileApp(realpath).get_relative_path(os.path.realpath(self.root)) == '/penguins_are_cute'
+        assert FileApp('/penguins_are_cute').get_relative_path(os.path.realpath(self.root)) is None
+
+    def test_templatesCache(self):
+        storage = Storage.lookup(self.root)
+        assert build_lookup(storage) is build_lookup(Storage.lookup(self.root))
+        self.app.get("/")
+        # compiled templates are kept for the next processes
+        cachedir = os.path.join(storage.path, 'cache', 'templates')
+        assert 'list.html.py' in os.listdir(cachedir)
+
     def test_pathNormalization(self):
         os.mkdir(os.path.join(self.root, "penguins"))
         with open(os.path.join(self.root, "penguins", "gentoo"), 'w') as f:
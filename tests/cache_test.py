@@ -0,0 +1,40 @@
+from assnet.cache import LRUCache
+from unittest import TestCase
+import time
+
+
+class CacheTest(TestCase):
+    def test_lru(self):
+        cache = LRUCache(2)
+        cache.set('gentoo', 1)
+        cache.set('emperor', 2)
+        assert cache.get('gentoo') == 1
+        # emperor is now the least recently used
+        cache.set('king', 3)
+        assert len(cache) == 2
+        assert 'emperor' not in cache
+        assert cache.get('emperor', 42) == 42
+        assert cache.get('gentoo') == 1
+        assert cache.pop('king') == 3
+        assert cache.pop('king') is None
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_ttl(self):
+        cache = LRUCache(2, ttl=0.2)
+        cache.set('gentoo', 1)
+        assert cache.get('gentoo') == 1
+        assert cache.pop('gentoo') == 1
+        cache.set('gentoo', 1)
+        time.sleep(0.3)
+        assert cache.get('gentoo') is None
+        assert len(cache) == 0
+
+        # entries can expire sooner, but not later
+        cache.set('gentoo', 1, 0.1)
+        cache.set('emperor', 2, 10)
+        time.sleep(0.15)
+        assert cache.get('gentoo') is None
+        assert cache.get('emperor') == 2
+        time.sleep(0.1)
+        assert cache.get('emperor') is None
@@ -1,5 +1,6 @@
 from assnet.storage import Storage
 from assnet.server import Server
+from assnet.cli import CLI
 
 from unittest import TestCase
 from webtest import TestApp
@@ -83,3 +84,42 @@ class GalleryTest(TestCase):
         img = Image.open(StringIO(res.body))
         assert img.size[0] == 1337
         assert img.size[1] == 1337
+
+    def test_buildThumbnails(self):
+        thumbdir = os.path.join(self.storage.path, 'thumbnails')
+        assert CLI(self.root).main(['assnet_test', 'thumbnails', 'build', 'images', '-j', '2']) in (0, None)
+        for size in (200, 300):
+            for name in ('image1.jpg', 'image2.jpg'):
+                f = self.storage.get_file('/images/%s' % name)
+                assert os.path.exists(os.path.join(thumbdir, str(size), '%s.jpg' % f.get_hash()))
+                assert os.path.exists(os.path.join(thumbdir, str(size), '%s.webp' % f.get_hash()))
+        assert len(os.listdir(os.path.join(thumbdir, '200'))) == 4
+
+        # served from the cache, without writing any configuration
+        res = self.app.get('/images/image1.jpg?view=thumbnail&thumb_size=200')
+        img = Image.open(StringIO(res.body))
+        assert img.size[0] == 200
+        assert not self.storage.get_file('/images/image1.jpg').exists
+
+        # nothing to do anymore
+        assert CLI(self.root).main(['assnet_test', 'thumbnails', 'build']) in (0, None)
+
+    def test_thumbnailFormats(self):
+        with open(os.path.join(self.root, 'images', 'rotated.jpg'), 'wb') as f:
+            img = Image.new('RGB', (1600, 800), (0, 0, 255))
+            exif = Image.Exif()
+            # rotated by 90 degrees clockwise
+            exif[0x0112] = 6
+            img.save(f, 'jpeg', exif=exif.tobytes())
+
+        res = self.app.get('/images/rotated.jpg?view=thumbnail&thumb_size=200')
+        assert res.headers['Content-Type'] == 'image/jpeg'
+        assert res.headers['Vary'] == 'Accept'
+        img = Image.open(StringIO(res.body))
+        assert img.size == (100, 200)
+
+        res = self.app.get('/images/rotated.jpg?view=thumbnail&thumb_size=200',
+                           headers={'Accept': 'image/webp,*/*'})
+        assert res.headers['Content-Type'] == 'image/webp'
+        img = Image.open(StringIO(res.body))
+        assert img.size == (100, 200)
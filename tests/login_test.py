@@ -1,12 +1,14 @@
 from assnet.storage import Storage
-from assnet.server import Server
+from assnet.server import Server, Dispatcher
 from assnet.users import User
 
 from unittest import TestCase
 from webtest import TestApp
+from paste.auth.cookie import AuthCookieSigner
 
 from tempfile import mkdtemp
 import shutil
+import time
 
 
 class LoginTest(TestCase):
@@ -86,3 +88,31 @@ class LoginTest(TestCase):
         res = res.follow(status=200)
         assert 'Login' in res.body
         assert 'Logged as' not in res.body
+
+    def test_httpLogin(self):
+        def auth(username, password):
+            return {'Authorization': 'Basic ' + ('%s:%s' % (username, password)).encode('base64').strip()}
+
+        res = self.app.get('/?authby=http', headers=auth('penguin', 'monkey1'), status=200)
+        assert 'Logged as <abbr title="Penguin">penguin</abbr>' in res.body
+        # verified credentials are cached
+        assert len(Dispatcher.CREDENTIALS)
+        res = self.app.get('/?authby=http', headers=auth('penguin', 'monkey1'), status=200)
+        assert 'Logged as <abbr title="Penguin">penguin</abbr>' in res.body
+        res = self.app.get('/?authby=http', headers=auth('_key', 'fabf37d746da8a45df63489f642b3813'),
+                           status=200)
+        assert 'Logged as <abbr title="Penguin">penguin</abbr>' in res.body
+        self.app.get('/?authby=http', headers=auth('penguin', 'monkey2'), status=401)
+
+        # cookies are not cached after they expire
+        signer = AuthCookieSigner(secret='penguin', timeout=60)
+        expires = Dispatcher.get_cookie_expires(signer.sign('penguin'))
+        assert 0 <= time.time() + 3600 - expires < 60
+
+        # the cache does not outlive a password change
+        user = Storage.lookup(self.root).get_user('penguin')
+        user.password = 'monkey2'
+        user.save()
+        self.app.get('/?authby=http', headers=auth('penguin', 'monkey1'), status=401)
+        res = self.app.get('/?authby=http', headers=auth('penguin', 'monkey2'), status=200)
+        assert 'Logged as <abbr title="Penguin">penguin</abbr>' in res.body
@@ -0,0 +1,76 @@
+from assnet.storage import Storage
+from assnet.server import Server
+from assnet.prefork import PreforkServer
+
+from unittest import TestCase
+
+from tempfile import mkdtemp
+from multiprocessing import Process
+import os
+import time
+import signal
+import shutil
+import socket
+import urllib2
+import sys
+from StringIO import StringIO
+
+
+class PreforkTest(TestCase):
+    def setUp(self):
+        self.root = mkdtemp(prefix='assnet_test_root')
+        Storage.create(self.root)
+        with open(os.path.join(self.root, 'penguins_are_cute'), 'w') as f:
+            f.write('HELLO')
+
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        self.port = s.getsockname()[1]
+        s.close()
+        self.process = Process(target=Server(self.root).bind,
+                               args=('127.0.0.1', self.port, 2, 2))
+        self.process.start()
+
+    def tearDown(self):
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        if self.root:
+            shutil.rmtree(self.root)
+
+    def get(self, path):
+        for i in xrange(50):
+            try:
+                return urllib2.urlopen('http://127.0.0.1:%d%s' % (self.port, path)).read()
+            except urllib2.URLError:
+                time.sleep(0.1)
+        raise AssertionError('No response from the server')
+
+    def test_workers(self):
+        # more requests than the workers accept before being replaced
+        for i in xrange(6):
+            assert self.get('/penguins_are_cute') == 'HELLO'
+            assert 'penguins_are_cute' in self.get('/')
+
+        os.kill(self.process.pid, signal.SIGHUP)
+        assert self.get('/penguins_are_cute') == 'HELLO'
+
+        self.process.terminate()
+        self.process.join(10)
+        assert self.process.exitcode == 0
+
+    def test_workerCrash(self):
+        class CrashingServer(PreforkServer):
+            def run_worker(self, heartbeat):
+                raise ValueError('penguin')
+        server = CrashingServer(None, '127.0.0.1', self.port, 1)
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            server.spawn_workers()
+            server.reap_workers(block=True)
+            output = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        assert not server.workers
+        assert 'exited with status 1' in output
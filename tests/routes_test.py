@@ -126,3 +126,36 @@ class RoutesTest(TestCase):
         assert View(name='test', object_type=None, mimetype='image').guess_priority() == 1
         assert View(name='test', object_type=None, mimetype='image/png').guess_priority() == 2
         assert View(name='test', object_type='file', mimetype='image/png').guess_priority() == 3
+
+    def test_compiledTable(self):
+        class CountingView(View):
+            checks = 0
+
+            def check_file(self, f):
+                CountingView.checks += 1
+                return f.name.startswith('penguin')
+
+        class StatFile(FakeFile):
+            mtime = 1
+
+            def get_stat(self):
+                return type('stat', (object,), {'st_mtime': self.mtime})
+
+            def get_realpath(self):
+                return '/' + self.name
+
+        router = Router()
+        router.register_view(View(object_type='directory', name='list'), fn1, 1)
+        router.compile()
+        router.register_view(CountingView(object_type='directory', name='website'), fn2, 2)
+
+        # the table is rebuilt after new views
+        f = StatFile(name='penguins', object_type='directory')
+        assert router.find_view(f)[1] is fn2
+        assert [v.name for v in router.get_available_views(f)] == ['list', 'website']
+        assert CountingView.checks == 1
+        f.mtime = 2
+        assert router.find_view(f)[1] is fn2
+        assert CountingView.checks == 2
+        assert router.find_view(StatFile(name='pingoo', object_type='directory'))[1] is fn1
+        assert router.find_view(FakeFile(name='penguin.txt', object_type='file'))[1] is None
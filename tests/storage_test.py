@@ -1,7 +1,9 @@
 from assnet.storage import Storage, GlobalConfig
+from assnet.backends import FileBackend
 from assnet.obj import ConfigDict
 from assnet.files import File
 from assnet.users import User
+from assnet.data import DataPaths
 from unittest import TestCase
 from tempfile import mkdtemp
 import shutil
@@ -22,6 +24,27 @@ class StorageTest(TestCase):
         assert len(storage.get_file('').perms) == 1
         assert len(storage.get_file('/.assnet').perms) == 1
 
+    def test_dataPaths(self):
+        Storage.create(self.root)
+        nb_paths = len(Storage.DATA_PATHS)
+        for i in xrange(3):
+            storage = Storage.lookup(self.root)
+        assert len(Storage.DATA_PATHS) == nb_paths
+        assert storage.data is Storage.lookup(self.root).data
+
+        os.makedirs(os.path.join(storage.path, 'data', 'assets'))
+        with open(os.path.join(storage.path, 'data', 'assets', 'main.css'), 'w') as f:
+            f.write('body { background-color: pink; }')
+        # the index is only built once
+        assert storage.data.find('assets', 'main.css') != \
+            os.path.join(storage.path, 'data', 'assets', 'main.css')
+        data = DataPaths(storage.data_paths)
+        assert data.find('assets', 'main.css') == \
+            os.path.join(storage.path, 'data', 'assets', 'main.css')
+        assert data.find('assets', 'list.js').endswith('/data/assets/list.js')
+        assert data.find('templates', 'list.html') is not None
+        assert data.find('assets', 'nothing.js') is None
+
     def test_configDict(self):
         d = ConfigDict()
         d['a']
@@ -136,6 +159,60 @@ class StorageTest(TestCase):
         # the file was NOT reloaded
         assert cfg.data['penguin'].get('gentoo') == u"1337"
 
+    def test_objectCache(self):
+        cfg = GlobalConfig(self.storage)
+        cfg.data['penguin']['gentoo'] = u"42"
+        cfg.save()
+        confpath = os.path.join(self.storage.path, cfg._get_confname())
+
+        data1 = self.storage._read(cfg._get_confname())
+        assert confpath in FileBackend.OBJECT_CACHE
+        data2 = self.storage._read(cfg._get_confname())
+        assert data1 == data2
+        # every caller gets its own copy
+        data1['penguin']['gentoo'] = u"1337"
+        assert data2['penguin']['gentoo'] == u"42"
+        assert self.storage._read(cfg._get_confname())['penguin']['gentoo'] == u"42"
+
+        # altered by something else
+        with open(confpath, 'w') as fp:
+            fp.write('[penguin]\ngentoo = 1337\n')
+        mtime = os.path.getmtime(confpath) + 1000
+        os.utime(confpath, (mtime, mtime))
+        assert self.storage._read(cfg._get_confname())['penguin']['gentoo'] == u"1337"
+
+        cfg.remove()
+        assert confpath not in FileBackend.OBJECT_CACHE
+        assert self.storage._read(cfg._get_confname()) is None
+
+    def test_configSnapshot(self):
+        storage = Storage.create(self.root)
+        cfg = storage.get_config()
+        assert storage.get_config() is cfg
+        assert storage.get_groupscfg() is storage.get_groupscfg()
+
+        # every write changes the generation
+        cfg.data['penguin']['gentoo'] = u"42"
+        cfg.save()
+        assert storage.get_config() is not cfg
+        assert storage.get_config().data['penguin']['gentoo'] == u"42"
+
+        # written by another storage
+        other = Storage.lookup(self.root)
+        other.get_config().data['penguin']['gentoo'] = u"1337"
+        other.get_config().save()
+        assert storage.get_config().data['penguin']['gentoo'] == u"1337"
+
+    def test_generation(self):
+        storage = Storage.create(self.root)
+        # never the same, even within the same mtime and with reused inodes
+        generations = [storage.get_generation()]
+        for i in xrange(10):
+            storage.touch()
+            generations.append(storage.get_generation())
+        assert len(set(generations)) == len(generations)
+        assert None not in generations
+
     def test_filePreAndPost(self):
         f = File(self.storage, '/penguin')
         f.perms['all'] = File.PERM_READ | File.PERM_LIST | File.PERM_IN
@@ -259,6 +336,33 @@ class StorageTest(TestCase):
         f = f.parent()
         assert f is None
 
+    def test_getChildrenStats(self):
+        os.mkdir(os.path.join(self.root, 'penguins'))
+        with open(os.path.join(self.root, 'penguins', 'gentoo'), 'w') as f:
+            f.write('HELLO')
+        os.symlink('gentoo', os.path.join(self.root, 'penguins', 'king'))
+        os.symlink('nowhere', os.path.join(self.root, 'penguins', 'broken'))
+        os.symlink('.', os.path.join(self.root, 'penguins', 'loop'))
+        f = self.storage.get_file('/penguins/gentoo')
+        f.view = 'html'
+        f.save()
+
+        children = list(self.storage.get_file('/penguins').iter_children())
+        assert [c.get_name() for c in children] == ['broken', 'gentoo', 'king', 'loop']
+        broken, gentoo, king, loop = children
+        assert not broken.file_exists()
+        assert broken.islink()
+        assert gentoo.isfile()
+        assert gentoo.get_size() == 5
+        assert gentoo.view == 'html'
+        assert not gentoo.islink()
+        assert gentoo.get_realpath() == os.path.realpath(os.path.join(self.root, 'penguins', 'gentoo'))
+        assert king.isfile()
+        assert king.islink()
+        assert king.get_realpath() == gentoo.get_realpath()
+        assert loop.isdir()
+        assert loop.islink()
+
     def test_getAttrs(self):
         os.mkdir(os.path.join(self.root, 'penguins'))
         with open(os.path.join(self.root, 'penguins', 'gentoo'), 'w') as f:
@@ -279,6 +383,29 @@ class StorageTest(TestCase):
         assert f.get_mtime().year > 0
         assert f.get_human_size() == '0 B'
 
+    def test_statOnce(self):
+        path = os.path.join(self.root, 'penguin')
+        with open(path, 'w') as f:
+            f.write('HELLO')
+
+        f = self.storage.get_file('/penguin')
+        assert f.isfile()
+        assert f.get_object_type() == 'file'
+        assert f.get_size() == 5
+        os.unlink(path)
+        os.mkdir(path)
+        # still the old state
+        assert f.isfile()
+        assert f.get_size() == 5
+        f.refresh()
+        assert f.isdir()
+        assert f.get_object_type() == 'directory'
+        os.rmdir(path)
+        f.refresh()
+        assert not f.file_exists()
+        assert f.get_object_type() is None
+        self.assertRaises(OSError, f.get_size)
+
     def test_getHumanSize(self):
         class Chafouin(File):
             def __init__(self, fakesize):
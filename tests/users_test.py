@@ -1,7 +1,9 @@
 from assnet.storage import Storage
-from assnet.users import User
+from assnet.users import User, Anonymous
+from assnet.files import File
 from unittest import TestCase
 from tempfile import mkdtemp
+from threading import Thread
 import shutil
 
 
@@ -64,3 +66,101 @@ class UsersTest(TestCase):
         assert len(u2.key)
         u2.gen_key()
         assert u2.key != u1.key
+
+    def test_permsResolver(self):
+        f = self.storage.get_file('/penguins')
+        f.set_user_perms('penguin', File.PERM_READ | File.PERM_LIST)
+        f.save()
+
+        u = User(self.storage, 'penguin')
+        u.read()
+        gentoo = self.storage.get_file('/penguins/gentoo')
+        emperor = self.storage.get_file('/penguins/emperor')
+        assert u.has_perms(gentoo, File.PERM_READ)
+        assert not u.has_perms(gentoo, File.PERM_WRITE)
+
+        # siblings do not read their parent again
+        reads = []
+        get_file = self.storage.get_file
+        self.storage.get_file = lambda path: reads.append(path) or get_file(path)
+        assert u.has_perms(emperor, File.PERM_LIST)
+        assert len(reads) == 0
+        a = Anonymous()
+        assert a.has_perms(emperor, File.PERM_READ)
+        assert not a.has_perms(emperor, File.PERM_WRITE)
+        assert reads == ['/penguins', '']
+        del self.storage.get_file
+
+        # changes of the file itself are taken into account
+        emperor.set_all_perms(0)
+        assert not a.has_perms(emperor, File.PERM_READ)
+        assert u.has_perms(emperor, File.PERM_READ) == 0
+        emperor.set_user_perms('penguin', File.PERM_WRITE)
+        assert u.has_perms(emperor, File.PERM_WRITE)
+
+    def test_keysIndex(self):
+        u1 = User(self.storage, 'penguin')
+        u1.key = 'fabf37d746da8a45df63489f642b3813'
+        u1.save()
+        u2 = User(self.storage, 'platypus')
+        u2.save()
+        # built on first use
+        assert not self.storage.get_keysindex(build=False).exists
+        assert self.storage.get_user_by_key(u1.key).name == 'penguin'
+        assert self.storage.get_keysindex(build=False).exists
+        assert self.storage.get_user_by_key('deadbeef') is None
+        assert self.storage.get_user_by_key(None) is None
+
+        # then updated on changes
+        u2.gen_key()
+        u2.save()
+        assert self.storage.get_user_by_key(u2.key).name == 'platypus'
+        old_key = u1.key
+        u1.gen_key()
+        u1.save()
+        assert self.storage.get_user_by_key(old_key) is None
+        assert self.storage.get_user_by_key(u1.key).name == 'penguin'
+        u1.remove()
+        assert self.storage.get_user_by_key(u1.key) is None
+        assert self.storage.get_user_by_key(u2.key).name == 'platypus'
+
+    def test_keysIndexConcurrency(self):
+        self.storage.get_keysindex()
+        # like two processes
+        storage1 = Storage(self.storage.path)
+        storage2 = Storage(self.storage.path)
+        u1 = User(storage1, 'penguin')
+        u1.key = 'fabf37d746da8a45df63489f642b3813'
+        u2 = User(storage2, 'platypus')
+        u2.key = 'c4f2ed3a5b8d7e6f1a0b9c8d7e6f5a4b'
+        u1.save()
+        u2.save()
+        assert self.storage.get_keysindex(build=False).get_username(u1.key) == 'penguin'
+        assert self.storage.get_keysindex(build=False).get_username(u2.key) == 'platypus'
+
+        def save_user(i):
+            user = User(Storage(self.storage.path), 'user%d' % i)
+            user.key = '%032x' % i
+            user.save()
+        threads = [Thread(target=save_user, args=(i,)) for i in xrange(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        index = self.storage.get_keysindex(build=False)
+        for i in xrange(20):
+            assert index.get_username('%032x' % i) == 'user%d' % i
+
+        # lost or edited by hand
+        u1.data['auth']['key'] = u'0123456789abcdef0123456789abcdef'
+        self.storage._write('users/penguin', u1.data)
+        assert self.storage.get_user_by_key('0123456789abcdef0123456789abcdef').name == 'penguin'
+        assert self.storage.get_user_by_key('fabf37d746da8a45df63489f642b3813') is None
+        assert self.storage.get_user_by_key(u2.key).name == 'platypus'
+
+        # unknown keys only check the index again once the generation changed
+        u1.data['auth']['key'] = u'00112233445566778899aabbccddeeff'
+        self.storage.backend.write('users/penguin', u1.data)
+        assert self.storage.get_user_by_key('00112233445566778899aabbccddeeff') is None
+        self.storage.touch()
+        assert self.storage.get_user_by_key('00112233445566778899aabbccddeeff').name == 'penguin'
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase, SkipTest
+from assnet.storage import Storage
+from assnet.recent import RecentIndex
+from assnet.inotify import INOTIFY_SUPPORT
+from assnet.plugins.watch import Watcher
+from tempfile import mkdtemp
+from StringIO import StringIO
+import shutil
+import os
+import sys
+
+
+class WatchTest(TestCase):
+    def setUp(self):
+        if not INOTIFY_SUPPORT:
+            raise SkipTest('inotify is not supported')
+        self.root = mkdtemp(prefix='assnet_test_root')
+        self.storage = Storage.create(self.root)
+        os.mkdir(os.path.join(self.root, 'penguins'))
+        with open(os.path.join(self.root, 'penguins', 'tux.png'), 'w') as f:
+            f.write('tux')
+        RecentIndex(self.storage).rebuild()
+        self.watcher = Watcher(self.storage)
+
+    def tearDown(self):
+        self.watcher.close()
+        if self.root:
+            shutil.rmtree(self.root)
+
+    def process(self):
+        while self.watcher.wait(0.1):
+            pass
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.watcher.flush()
+        finally:
+            sys.stdout = stdout
+
+    def test_storageChange(self):
+        generation = self.storage.get_generation()
+        self.process()
+        assert self.storage.get_generation() == generation
+
+        # edited by hand
+        with open(os.path.join(self.storage.path, 'files', 'hello'), 'w') as f:
+            f.write('')
+        self.process()
+        generation2 = self.storage.get_generation()
+        assert generation2 != generation
+        # our own touch() is not a change
+        self.process()
+        assert self.storage.get_generation() == generation2
+
+        # neither are objects written by assnet, which touches it itself
+        f = self.storage.get_file('/penguins')
+        f.view = 'gallery'
+        f.save()
+        self.storage.get_keysindex()
+        with self.storage.lock('penguins'):
+            pass
+        generation3 = self.storage.get_generation()
+        self.process()
+        assert self.storage.get_generation() == generation3
+
+    def test_treeChange(self):
+        os.mkdir(os.path.join(self.root, 'penguins', 'new'))
+        with open(os.path.join(self.root, 'penguins', 'new', 'gentoo.txt'), 'w') as f:
+            f.write('gentoo')
+        self.process()
+        assert [entry[0] for entry in RecentIndex(self.storage).iter_entries('/penguins')] \
+                == ['/penguins/new/gentoo.txt', '/penguins/new', '/penguins/tux.png']
+
+        # a watch was added to the new directory
+        with open(os.path.join(self.root, 'penguins', 'new', 'adelie.txt'), 'w') as f:
+            f.write('adelie')
+        self.process()
+        assert '/penguins/new/adelie.txt' in \
+                [entry[0] for entry in RecentIndex(self.storage).get_entries()]
+
+    def test_prune(self):
+        f = self.storage.get_file('/penguins/tux.png')
+        f.view = 'gallery'
+        f.save()
+        thumbpath = self.watcher.thumbnailer.get_path(f, 200, 'png')
+        os.makedirs(os.path.dirname(thumbpath))
+        with open(thumbpath, 'w') as fp:
+            fp.write('thumb')
+        d = self.storage.get_file('/penguins')
+        d.view = 'gallery'
+        d.save()
+        self.process()
+
+        # replaced, i.e. by an editor
+        os.rename(os.path.join(self.root, 'penguins', 'tux.png'), os.path.join(self.root, 'tux.png'))
+        with open(os.path.join(self.root, 'penguins', 'tux.png'), 'w') as fp:
+            fp.write('tux2')
+        self.process()
+        assert self.storage.get_file('/penguins/tux.png').exists
+        assert os.path.exists(thumbpath)
+
+        # configurations are kept by default, i.e. if it comes back
+        os.rename(os.path.join(self.root, 'penguins'), os.path.join(self.root, 'penguins.old'))
+        self.process()
+        assert self.storage.get_file('/penguins/tux.png').exists
+        assert self.storage.get_file('/penguins').exists
+        assert not os.path.exists(thumbpath)
+        paths = [entry[0] for entry in RecentIndex(self.storage).get_entries()]
+        assert '/penguins.old/tux.png' in paths and '/penguins/tux.png' not in paths
+
+        self.watcher.prune = True
+        os.rename(os.path.join(self.root, 'penguins.old'), os.path.join(self.root, 'penguins'))
+        self.process()
+        shutil.rmtree(os.path.join(self.root, 'penguins'))
+        self.process()
+        assert not self.storage.get_file('/penguins/tux.png').exists
+        assert not self.storage.get_file('/penguins').exists
+
+    def test_dotDotNames(self):
+        # in the tree, even if they look like a parent
+        path = os.path.join(self.root, '..penguin.txt')
+        with open(path, 'w') as f:
+            f.write('tux')
+        self.process()
+        assert RecentIndex(self.storage).get_entries()[0][0] == '/..penguin.txt'
+
+        self.watcher.prune = True
+        f = self.storage.get_file('/..penguin.txt')
+        f.view = 'raw'
+        f.save()
+        self.process()
+        os.unlink(path)
+        self.process()
+        assert not self.storage.get_file('/..penguin.txt').exists
+        assert '/..penguin.txt' not in [entry[0] for entry in RecentIndex(self.storage).get_entries()]
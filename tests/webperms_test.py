@@ -159,6 +159,44 @@ class WebPermsTest(TestCase):
         assert 'gentoo' not in res.body
         self.app.get('/penguins/gentoo', status=200)
 
+    def test_authz(self):
+        os.mkdir(os.path.join(self.root, 'penguins'))
+        with open(os.path.join(self.root, 'penguins', 'gentoo'), 'w') as f:
+            f.write('HELLO')
+
+        self.app.get('/?action=authz&path=/penguins/gentoo', status=204)
+        self.app.get('/?action=authz', headers={'X-Original-URI': '/penguins/gentoo?x=1'}, status=204)
+        self.app.get('/?action=authz&path=/.assnet/config', status=403)
+
+        # the cache is emptied by any change of the storage
+        self._set_perms('/penguins', all=0, u_penguin=File.PERM_READ)
+        self.app.get('/?action=authz&path=/penguins/gentoo', status=403)
+        self.app.get('/?action=authz&path=/penguins/gentoo&authkey=fabf37d746da8a45df63489f642b3813',
+                     status=204)
+        self.app.get('/?action=authz',
+                     headers={'X-Original-URI': '/penguins/gentoo?authkey=fabf37d746da8a45df63489f642b3813'},
+                     status=204)
+        self.app.get('/?action=authz&authby=http&path=/penguins/gentoo', status=401)
+        self.app.get('/?action=authz&authby=http&path=/penguins/gentoo',
+                     headers={'Authorization': 'Basic ' + 'penguin:monkey1'.encode('base64').strip()},
+                     status=204)
+
+    def test_authzTraversal(self):
+        os.mkdir(os.path.join(self.root, 'public'))
+        os.mkdir(os.path.join(self.root, 'private'))
+        with open(os.path.join(self.root, 'public', 'secret'), 'w') as f:
+            f.write('HELLO')
+        with open(os.path.join(self.root, 'private', 'secret'), 'w') as f:
+            f.write('HELLO')
+        self._set_perms('/private', all=0)
+
+        self.app.get('/?action=authz', headers={'X-Original-URI': '/private/secret'}, status=403)
+        for uri in ('/public/../private/secret', '/public/%2e%2e/private/secret',
+                    '/public/..%2fprivate/secret'):
+            self.app.get('/?action=authz', headers={'X-Original-URI': uri}, status=403)
+        self.app.get('/?action=authz&path=/public/../private/secret', status=403)
+        self.app.get('/?action=authz', headers={'X-Original-URI': '/public/secret'}, status=204)
+
     def _set_perms(self, path, **perms):
         f = self.storage.get_file(path)
         f.perms = {}
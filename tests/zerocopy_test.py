@@ -0,0 +1,75 @@
+from assnet.storage import Storage
+from assnet.server import Server
+from assnet.zerocopy import sendfile, SENDFILE_SUPPORT, FileWrapper
+
+from unittest import TestCase
+
+from tempfile import mkdtemp, TemporaryFile
+from multiprocessing import Process
+import os
+import time
+import shutil
+import socket
+import urllib2
+
+
+class ZeroCopyTest(TestCase):
+    def setUp(self):
+        self.root = mkdtemp(prefix='assnet_test_root')
+        Storage.create(self.root)
+        self.data = ''.join([chr(i % 256) for i in xrange(256 * 1024)])
+        with open(os.path.join(self.root, 'penguins.bin'), 'wb') as f:
+            f.write(self.data)
+        self.process = None
+
+    def tearDown(self):
+        if self.process and self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        if self.root:
+            shutil.rmtree(self.root)
+
+    def test_fileWrapper(self):
+        with open(os.path.join(self.root, 'penguins.bin'), 'rb') as f:
+            f.seek(1000)
+            assert ''.join(FileWrapper(f, 4096, 10000)) == self.data[1000:11000]
+            f.seek(1000)
+            assert ''.join(FileWrapper(f, 4096)) == self.data[1000:]
+
+        if not SENDFILE_SUPPORT:
+            return
+        a, b = socket.socketpair()
+        with TemporaryFile() as f:
+            f.write('penguins are cute')
+            f.flush()
+            assert sendfile(a.fileno(), f.fileno(), 13, 4) == 4
+        assert b.recv(10) == 'cute'
+        a.close()
+        b.close()
+
+    def test_threadedServe(self):
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+        s.close()
+        self.process = Process(target=Server(self.root).bind, args=('127.0.0.1', port))
+        self.process.start()
+
+        def open_url(path, headers={}):
+            for i in xrange(50):
+                try:
+                    return urllib2.urlopen(urllib2.Request(
+                        'http://127.0.0.1:%d%s' % (port, path), headers=headers))
+                except urllib2.URLError, e:
+                    if isinstance(e, urllib2.HTTPError):
+                        raise
+                    time.sleep(0.1)
+            raise AssertionError('No response from the server')
+
+        res = open_url('/penguins.bin')
+        assert res.info()['Content-Length'] == str(len(self.data))
+        assert res.read() == self.data
+
+        res = open_url('/penguins.bin', {'Range': 'bytes=100000-100099'})
+        assert res.getcode() == 206
+        assert res.read() == self.data[100000:100100]